@@ -0,0 +1,420 @@
+import sys, os
+import argparse
+import json
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+import timeit
+import tracemalloc
+import numpy as np
+import pysam
+from typing import *
+
+# force PYTHONPATH to look into the project directory for modules
+rootdir = os.path.dirname(os.path.dirname(os.getcwd()))
+sys.path.insert(0, rootdir)
+
+from VCFPooling.poolSNPs.pooler import *
+from VCFPooling.poolSNPs import poolvcf
+from VCFPooling.poolSNPs import gtstore
+from VCFPooling.poolSNPs import kernels
+from VCFPooling.poolSNPs.gtreader import GenotypeReader, GenotypeBatch, SITE_DTYPE
+from VCFPooling.benchmarks import synthetic
+
+'''
+Benchmarks of the pooling pipeline, stage by stage: reading, encoding, decoding, serialization and compression.
+For every input file and stage, the throughput (variants/sec) and the peak memory allocated by the stage
+are measured, and appended to a history file (one JSON record per line) with the commit and the platform.
+
+Inputs are the example file of the project and synthetic files scaled along the variants axis
+(at a fixed number of samples) and along the samples axis (at a fixed number of variants).
+Only the first samples which fit in blocks are pooled e.g. 2496 of the 2504 samples of the example file.
+Stages looping over variants with the single-variant API (e.g. Encoder.encode) run on the first variants only
+(--max-loop-variants), the other stages run on all the variants by batches.
+
+With --check, the run is compared to the previous runs in the history on the same input and stage
+and exits with status 1 if a stage is slower than their median by more than the tolerance.
+
+Command line usage (assuming the current directory is VCFPooling/benchmarks)
+$ python3 -u bench_pooling.py [--variants 1000 4000 16000] [--samples 240 960 3840] [--stages encode_batch ...]
+[--history history.jsonl] [--check]
+'''
+
+PATH_EXAMPLES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'examples')
+
+
+class BenchInput(object):
+    """
+    Genotypes of an input file loaded once in memory, and the pooling objects the stages run with.
+    """
+    def __init__(self, path: str, name: str, path_lookup: str, batch_size: int = 1000, max_loop: int = 1000,
+                 path_store: str = None):
+        """
+        :param path: path to the VCF file (GT format)
+        :param name: name of the input in the results
+        :param path_lookup: path to the csv file with the adaptive GL values
+        :param batch_size: number of variants per batch
+        :param max_loop: number of variants for the stages using the single-variant API
+        :param path_store: path to the genotype store of the file, see gtstore.store_path per default
+        """
+        self.path = path
+        self.name = name
+        self.path_store = path_store
+        self.batch_size = batch_size
+        batches = list(GenotypeReader(path, batch_size))
+        block_size = np.prod(Design().shape)
+        n_samples = len(GenotypeReader(path).samples) // block_size * block_size  # samples fitting in blocks
+        self.gt = np.concatenate([b.gt[:, :n_samples] for b in batches]) if batches \
+            else np.empty((0, n_samples, 2), dtype=np.int8)
+        self.sites = np.concatenate([b.sites for b in batches]) if batches else np.empty(0, dtype=SITE_DTYPE)
+        self.dosages = self.gt.sum(axis=-1)
+        self.n_variants, self.n_samples = self.dosages.shape
+        self.n_loop = min(max_loop, self.n_variants)
+        self.design = Design(blocks=self.n_samples // block_size)
+        self.lookup_dict = load_lookup_dict(path_lookup)
+        self.lookup_keys, self.lookup_vals = get_lookup_arrays(os.path.dirname(path_lookup))
+        self.index, self.vals = load_compiled_lookup(path_lookup)
+        self.context = poolvcf.PoolingContext(self.design, self.n_samples, (self.index, self.vals), 'GP')
+        self.pattern_decoder = PatternDecoder(self.design, self.index, self.vals)  # patterns table built once
+        self.pooled = self.context.pool(self.gt)  # (variants, blocks, pools)
+        self._store = None
+        self.header = None
+        self.lines = None
+
+    @property
+    def store(self) -> gtstore.GenotypeStore:
+        """Genotype store of the input, converted at first access"""
+        if self._store is None:
+            self._store = gtstore.open_store(self.path, path=self.path_store, formats=['GT'],
+                                             batch_size=self.batch_size)
+        return self._store
+
+    def slices(self, n_variants: int = None) -> Iterator[slice]:
+        n_variants = self.n_variants if n_variants is None else n_variants
+        for start in range(0, n_variants, self.batch_size):
+            yield slice(start, min(start + self.batch_size, n_variants))
+
+    def pooled_lines(self) -> List[str]:
+        """Header and pooled variants of the input, serialized once for the compression stages"""
+        if self.lines is None:
+            vcf_in = pysam.VariantFile(self.path)
+            poolvcf.pooled_header(vcf_in.header, 'GP')
+            header = str(vcf_in.header).rstrip('\n').split('\n')
+            self.header = poolvcf.header_samples(header, list(vcf_in.header.samples)[:self.n_samples])
+            self.lines = list(serialized_lines(self))
+        return [self.header] + self.lines
+
+
+def stage_read_pysam(data: BenchInput) -> int:
+    """GT read from pysam records, sample by sample"""
+    for n, rec in enumerate(pysam.VariantFile(data.path)):
+        if n == data.n_loop:
+            break
+        [g['GT'] for g in rec.samples.values()]
+    return data.n_loop
+
+
+def stage_read_gtreader(data: BenchInput) -> int:
+    """GT read by batches with gtreader.GenotypeReader"""
+    return sum(len(batch) for batch in GenotypeReader(data.path, data.batch_size))
+
+
+def stage_convert_store(data: BenchInput) -> int:
+    """One-time conversion to a genotype store"""
+    path = tempfile.mkdtemp()
+    try:
+        return gtstore.convert_vcf(data.path, os.path.join(path, 'bench.gts'), batch_size=data.batch_size).n_variants
+    finally:
+        shutil.rmtree(path)
+
+
+def stage_read_store(data: BenchInput) -> int:
+    """GT read by batches from a genotype store (conversion not measured)"""
+    n_variants = 0
+    for batch in data.store.batches(data.batch_size):
+        batch.gt.sum()  # mapped data are read when accessed
+        n_variants += len(batch)
+    return n_variants
+
+
+def stage_encode(data: BenchInput) -> int:
+    """Encoder.encode, variant by variant"""
+    encoder = Encoder(data.design)
+    for v in range(data.n_loop):
+        encoder.encode(data.dosages[v])
+    return data.n_loop
+
+
+def stage_encode_batch(data: BenchInput) -> int:
+    """Encoder.encode_batch"""
+    encoder = Encoder(data.design)
+    for sl in data.slices():
+        encoder.encode_batch(data.dosages[sl])
+    return data.n_variants
+
+
+def stage_decode_gt(data: BenchInput) -> int:
+    """Decoder.decode_genotypes_gt, variant by variant"""
+    decoder = Decoder(data.design, data.lookup_keys, data.lookup_vals, 'GT')
+    for v in range(data.n_loop):
+        decoder.decode_genotypes_gt(data.pooled[v])
+    return data.n_loop
+
+
+def stage_decode_gp(data: BenchInput) -> int:
+    """Decoder.decode_genotypes_gp, variant by variant"""
+    decoder = Decoder(data.design, data.lookup_keys, data.lookup_vals, 'GP')
+    for v in range(data.n_loop):
+        decoder.decode_genotypes_gp(data.pooled[v])
+    return data.n_loop
+
+
+def stage_decode_dict_gp(data: BenchInput) -> int:
+    """DictBlockDecoder.decode_genotypes_gp, block by block"""
+    decoder = DictBlockDecoder(Design().matrix, data.lookup_dict, 'GP')
+    for v in range(data.n_loop):
+        for block in data.pooled[v]:
+            decoder.decode_genotypes_gp(block)
+    return data.n_loop
+
+
+def stage_decode_batch_gt(data: BenchInput) -> int:
+    """Decoder.decode_batch_gt (lookup keys computed for every block)"""
+    decoder = Decoder(data.design, data.lookup_keys, data.lookup_vals, 'GT')
+    for sl in data.slices():
+        decoder.decode_batch_gt(data.pooled[sl])
+    return data.n_variants
+
+
+def stage_decode_batch_gp(data: BenchInput) -> int:
+    """Decoder.decode_batch_gp (lookup keys computed for every block)"""
+    decoder = Decoder(data.design, data.lookup_keys, data.lookup_vals, 'GP')
+    for sl in data.slices():
+        decoder.decode_batch_gp(data.pooled[sl])
+    return data.n_variants
+
+
+def stage_pattern_gt(data: BenchInput) -> int:
+    """PatternDecoder.decode_batch_gt (decoded patterns table built once, not measured)"""
+    for sl in data.slices():
+        data.pattern_decoder.decode_batch_gt(data.pooled[sl])
+    return data.n_variants
+
+
+def stage_pattern_gp(data: BenchInput) -> int:
+    """PatternDecoder.decode_batch_gp (decoded patterns table built once, not measured)"""
+    for sl in data.slices():
+        data.pattern_decoder.decode_batch_gp(data.pooled[sl])
+    return data.n_variants
+
+
+def stage_kernel_gt(data: BenchInput) -> int:
+    """kernels.pool_decode_gt with the numba backend (pooling and decoding fused, NumPy if numba is missing)"""
+    for sl in data.slices():
+        kernels.pool_decode_gt(data.dosages[sl], data.design.shape, backend='numba')
+    return data.n_variants
+
+
+def stage_kernel_gp(data: BenchInput) -> int:
+    """kernels.pool_decode_rows with the numba backend (pooling and decoding fused, NumPy if numba is missing)"""
+    for sl in data.slices():
+        kernels.pool_decode_rows(data.dosages[sl], data.design.shape, data.index, backend='numba')
+    return data.n_variants
+
+
+def serialized_lines(data: BenchInput) -> Iterator[str]:
+    for sl in data.slices():
+        gt = data.gt[sl]
+        yield from data.context.new_vars(GenotypeBatch(gt, gt < 0, data.sites[sl], []))
+
+
+def stage_serialize(data: BenchInput) -> int:
+    """Pooling and formatting of the pooled variants as VCF lines (PoolingContext.new_vars)"""
+    return sum(1 for _ in serialized_lines(data))
+
+
+def stage_compress_bgzf(data: BenchInput) -> int:
+    """Compression of the pooled lines to bgzipped VCF"""
+    lines = data.pooled_lines()
+    with tempfile.TemporaryDirectory() as path:
+        poolvcf.write_bgzf(os.path.join(path, 'bench.vcf.gz'), lines)
+    return len(lines) - 1
+
+
+def stage_compress_bcf(data: BenchInput) -> int:
+    """Conversion of the pooled lines to BCF"""
+    lines = data.pooled_lines()
+    with tempfile.TemporaryDirectory() as path:
+        poolvcf.write_bcf(os.path.join(path, 'bench.bcf'), lines)
+    return len(lines) - 1
+
+
+STAGES = {'read_pysam': stage_read_pysam,
+          'read_gtreader': stage_read_gtreader,
+          'convert_store': stage_convert_store,
+          'read_store': stage_read_store,
+          'encode': stage_encode,
+          'encode_batch': stage_encode_batch,
+          'decode_gt': stage_decode_gt,
+          'decode_gp': stage_decode_gp,
+          'decode_dict_gp': stage_decode_dict_gp,
+          'decode_batch_gt': stage_decode_batch_gt,
+          'decode_batch_gp': stage_decode_batch_gp,
+          'pattern_gt': stage_pattern_gt,
+          'pattern_gp': stage_pattern_gp,
+          'kernel_gt': stage_kernel_gt,
+          'kernel_gp': stage_kernel_gp,
+          'serialize': stage_serialize,
+          'compress_bgzf': stage_compress_bgzf,
+          'compress_bcf': stage_compress_bcf}
+
+
+def measure(func: Callable, data: BenchInput, repeat: int = 1, memory: bool = True) -> dict:
+    """
+    Measures the best time of a stage over several runs, and the peak memory allocated by one run
+    (traced in a separate run, as tracing slows down execution)
+    """
+    seconds = []
+    for _ in range(repeat):
+        tm = timeit.default_timer()
+        n_variants = func(data)
+        seconds.append(timeit.default_timer() - tm)
+    peak = None
+    if memory:
+        tracemalloc.start()
+        func(data)
+        peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+    best = min(seconds)
+    return {'n_variants': n_variants,
+            'seconds': best,
+            'variants_per_sec': n_variants / best if best > 0 else None,
+            'peak_mb': peak}
+
+
+def run_info() -> dict:
+    """Commit and platform of a benchmark run"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'commit': commit,
+            'host': platform.node(),
+            'machine': platform.machine(),
+            'cpus': os.cpu_count(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'backend': kernels.get_backend(),
+            'pysam': pysam.__version__}
+
+
+def load_history(path: str) -> List[dict]:
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def append_history(path: str, records: List[dict]) -> None:
+    with open(path, 'a') as f:
+        for rec in records:
+            f.write(json.dumps(rec) + '\n')
+
+
+def check_regressions(history: List[dict], records: List[dict], tolerance: float = 0.25) -> List[str]:
+    """
+    Compares the throughput of a run to the median of the previous runs on the same input, stage and host
+    :return: descriptions of the stages slower than the median by more than the tolerance
+    """
+    regressions = []
+    for rec in records:
+        previous = [h['variants_per_sec'] for h in history
+                    if (h['input'], h['n_variants'], h['n_samples'], h['stage'], h['host'])
+                    == (rec['input'], rec['n_variants'], rec['n_samples'], rec['stage'], rec['host'])
+                    and h['variants_per_sec'] is not None]
+        if len(previous) == 0 or rec['variants_per_sec'] is None:
+            continue
+        median = float(np.median(previous))
+        if rec['variants_per_sec'] < (1 - tolerance) * median:
+            regressions.append('{} on {}: {:.1f} variants/sec vs. median {:.1f} of {} runs'.format(
+                rec['stage'], rec['input'], rec['variants_per_sec'], median, len(previous)))
+    return regressions
+
+
+def bench_inputs(argsin: argparse.Namespace) -> Iterator[Tuple[str, str]]:
+    """Names and paths of the input files: example files, then synthetic files"""
+    for path in argsin.input:
+        yield os.path.basename(path), path
+    scales = [(v, argsin.base_samples) for v in argsin.variants] + [(argsin.base_variants, s) for s in argsin.samples]
+    for n_variants, n_samples in list(dict.fromkeys(scales)):
+        path = synthetic.synthetic_vcf(argsin.data_dir, n_variants, n_samples, seed=argsin.seed)
+        yield 'synthetic', path
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the stages of the pooling pipeline')
+    parser.add_argument('--input', type=str, nargs='*', help='VCF files to benchmark (GT format)',
+                        default=[os.path.join(PATH_EXAMPLES, 'ALL.chr20.snps.gt.vcf.gz')])
+    parser.add_argument('--variants', type=int, nargs='*', help='Synthetic files: numbers of variants',
+                        default=[1000, 4000, 16000])
+    parser.add_argument('--samples', type=int, nargs='*', help='Synthetic files: numbers of samples',
+                        default=[240, 960, 3840])
+    parser.add_argument('--base-variants', type=int, help='Number of variants when scaling samples', default=2000)
+    parser.add_argument('--base-samples', type=int, help='Number of samples when scaling variants', default=480)
+    parser.add_argument('--seed', type=int, help='Seed of the synthetic files', default=123)
+    parser.add_argument('--stages', type=str, nargs='*', choices=list(STAGES.keys()), default=list(STAGES.keys()))
+    parser.add_argument('--batch-size', type=int, help='Variants per batch', default=1000)
+    parser.add_argument('--max-loop-variants', type=int, help='Variants for the single-variant API stages',
+                        default=1000)
+    parser.add_argument('--repeat', type=int, help='Runs of a stage, the best time is kept', default=1)
+    parser.add_argument('--no-memory', action='store_true', help='Do not measure peak memory')
+    parser.add_argument('--lookup', type=str, help='Lookup table for GP decoding',
+                        default=os.path.join(PATH_EXAMPLES, 'adaptive_gls.csv'))
+    parser.add_argument('--data-dir', type=str, help='Directory for the synthetic files',
+                        default=os.path.join(tempfile.gettempdir(), 'vcfpooling-bench'))
+    parser.add_argument('--history', type=str, help='History of the benchmark results (JSON lines)',
+                        default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'history.jsonl'))
+    parser.add_argument('--check', action='store_true', help='Exit with status 1 if a stage regressed')
+    parser.add_argument('--tolerance', type=float, help='Relative slowdown tolerated by --check', default=0.25)
+    argsin = parser.parse_args()
+
+    info = run_info()
+    history = load_history(argsin.history)
+    records = []
+    for name, path in bench_inputs(argsin):
+        data = BenchInput(path, name, argsin.lookup, argsin.batch_size, argsin.max_loop_variants,
+                          path_store=os.path.join(argsin.data_dir, os.path.basename(path) + '.gts'))
+        print('\n{}: {} variants x {} samples'.format(path, data.n_variants, data.n_samples).ljust(80, '.'))
+        if 'read_store' in argsin.stages:
+            data.store  # conversion is not part of the stage
+        if 'kernel_gt' in argsin.stages or 'kernel_gp' in argsin.stages:
+            # JIT compilation is not part of the stages
+            kernels.pool_decode_gt(data.dosages[:1], data.design.shape, backend='numba')
+            kernels.pool_decode_rows(data.dosages[:1], data.design.shape, data.index, backend='numba')
+        for stage in argsin.stages:
+            result = measure(STAGES[stage], data, argsin.repeat, not argsin.no_memory)
+            rec = dict(info)
+            rec.update({'input': name,
+                        'path': os.path.abspath(path),
+                        'n_variants': data.n_variants,  # size of the input
+                        'n_samples': data.n_samples,
+                        'stage': stage,
+                        'n_variants_run': result['n_variants'],  # the stage may run on the first variants only
+                        'seconds': result['seconds'],
+                        'variants_per_sec': result['variants_per_sec'],
+                        'peak_mb': result['peak_mb']})
+            records.append(rec)
+            print('{:<18} {:>12.1f} variants/sec {:>10} MB'.format(
+                stage, rec['variants_per_sec'] or 0.0,
+                '-' if rec['peak_mb'] is None else '{:.1f}'.format(rec['peak_mb'])))
+    append_history(argsin.history, records)
+    print('\r\nResults appended to {}'.format(argsin.history))
+    if argsin.check:
+        regressions = check_regressions(history, records, argsin.tolerance)
+        for reg in regressions:
+            print('REGRESSION: ' + reg)
+        sys.exit(1 if len(regressions) > 0 else 0)
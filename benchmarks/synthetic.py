@@ -0,0 +1,79 @@
+import sys, os
+import itertools
+import numpy as np
+from typing import *
+
+# force PYTHONPATH to look into the project directory for modules
+rootdir = os.path.dirname(os.path.dirname(os.getcwd()))
+sys.path.insert(0, rootdir)
+
+from VCFPooling.poolSNPs.poolvcf import write_bgzf, index_compressed
+
+"""
+Synthetic VCF files for benchmarking the pooling pipeline at any scale.
+Genotypes are phased GT calls of biallelic SNPs, drawn independently for every sample
+from allele frequencies skewed towards rare variants (as in 1000 Genomes data).
+Files are reproducible from their seed, and cached in the data directory.
+"""
+
+PHASED_TOKENS = np.asarray(['0|0', '0|1', '1|0', '1|1'], dtype=object)  # indexed by 2 * allele1 + allele2
+BASES = np.asarray(['A', 'C', 'G', 'T'], dtype=object)
+
+
+def synthetic_name(n_variants: int, n_samples: int, seed: int = 123) -> str:
+    return 'SYN.v{}.s{}.seed{}.vcf.gz'.format(n_variants, n_samples, seed)
+
+
+def synthetic_header(n_samples: int, contig: str = '20') -> str:
+    lines = ['##fileformat=VCFv4.2',
+             '##FILTER=<ID=PASS,Description="All filters passed">',
+             '##contig=<ID={}>'.format(contig),
+             '##INFO=<ID=AC,Number=A,Type=Integer,Description="Alternate allele count">',
+             '##INFO=<ID=AF,Number=A,Type=Float,Description="Alternate allele frequency">',
+             '##INFO=<ID=AN,Number=1,Type=Integer,Description="Total number of alleles">',
+             '##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">',
+             '\t'.join(['#CHROM', 'POS', 'ID', 'REF', 'ALT', 'QUAL', 'FILTER', 'INFO', 'FORMAT']
+                       + ['S{:06d}'.format(i) for i in range(n_samples)])]
+    return '\n'.join(lines) + '\n'
+
+
+def synthetic_lines(n_variants: int, n_samples: int, seed: int = 123, contig: str = '20',
+                    batch_size: int = 1000) -> Iterator[str]:
+    """
+    Generates data lines of a synthetic VCF file
+    :param n_variants: number of variants
+    :param n_samples: number of samples
+    :param seed: seed of the random generator
+    :param contig: name of the contig of the variants
+    :param batch_size: number of variants drawn at once
+    """
+    rng = np.random.default_rng(seed)
+    positions = 60000 + np.cumsum(rng.integers(1, 200, size=n_variants))
+    for start in range(0, n_variants, batch_size):
+        stop = min(start + batch_size, n_variants)
+        af = rng.beta(0.5, 3.0, size=stop - start)
+        alleles = (rng.random((stop - start, n_samples, 2)) < af[:, np.newaxis, np.newaxis]).astype(np.int8)
+        tokens = PHASED_TOKENS[2 * alleles[..., 0] + alleles[..., 1]]
+        ac = alleles.sum(axis=(1, 2))
+        ref = rng.integers(0, 4, size=stop - start)
+        alt = (ref + rng.integers(1, 4, size=stop - start)) % 4
+        for v in range(stop - start):
+            info = 'AC={};AF={:.6g};AN={}'.format(ac[v], ac[v] / (2 * n_samples), 2 * n_samples)
+            yield '\t'.join([contig, str(positions[start + v]), 'rs{}'.format(start + v + 1),
+                             BASES[ref[v]], BASES[alt[v]], '.', 'PASS', info, 'GT', *tokens[v].tolist()]) + '\n'
+
+
+def synthetic_vcf(data_dir: str, n_variants: int, n_samples: int, seed: int = 123) -> str:
+    """
+    Writes a bgzipped and indexed synthetic VCF file, unless it is already in the data directory.
+    :return: path to the file
+    """
+    path = os.path.join(data_dir, synthetic_name(n_variants, n_samples, seed))
+    if not (os.path.exists(path) and os.path.exists(path + '.csi')):
+        os.makedirs(data_dir, exist_ok=True)
+        path_tmp = '{}.{}.tmp.vcf.gz'.format(path[:-len('.vcf.gz')], os.getpid())
+        lines = itertools.chain([synthetic_header(n_samples)], synthetic_lines(n_variants, n_samples, seed))
+        write_bgzf(path_tmp, lines)
+        os.replace(path_tmp, path)
+        index_compressed(path)
+    return path
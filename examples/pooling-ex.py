@@ -20,13 +20,17 @@ The decoding step of pooling is adaptive with respect to the pooling pattern obs
 * the samples are assumed to be sorted in row-order flattened blocks order e.g. the 16 first columns in the VCF file
 correspond  to the samples assigned to the first block. 
 Samples 1-4 form the first pool in the block, samples 5-8 the second pool, and so on.
-* the output file has to be written to unbgzipped format (.vcf) and then compressed to 
-bgzipped format (.vcf.gz) with bcftools.
+* the pooled variants are streamed to bgzipped format (.vcf.gz), or to binary format if the output
+file name ends with .bcf, and the file is indexed (.csi) when completed.
 
-For VCF-file bigger than some dozen of thousands of variants, pooling can be parallelized.
+For VCF-file bigger than some dozen of thousands of variants, pooling can be parallelized
+over genomic regions of the indexed input file with the option --processes.
+With the option --checkpoint-dir, pooled regions are committed to that directory,
+and an interrupted run started again with the same directory pools only the remaining regions.
+All the contigs of the input file are pooled, into one output file or into one file per contig (--split-contigs).
 
 Command line usage (assuming the current directory is VCFPooling/examples
-$ python3 -u pooling-ex.py <path-to-file-in> <path-to-file-out>
+$ python3 -u pooling-ex.py <path-to-file-in> <path-to-file-out> [--processes <n>] [--checkpoint-dir <dir>] [--split-contigs]
 '''
 
 ### COMMAND-LINE PARSING AND PARAMETERS
@@ -34,6 +38,9 @@ parser = argparse.ArgumentParser(description='Run pooling simulation'
                                              'on the whole set of samples')
 parser.add_argument('pathin', metavar='in', type=str, help='File to pool', default=None)
 parser.add_argument('pathout', metavar='out', type=str, help='Pooled file', default=None)
+parser.add_argument('--processes', type=int, help='Number of processes pooling regions in parallel', default=1)
+parser.add_argument('--checkpoint-dir', type=str, help='Directory for resuming an interrupted run', default=None)
+parser.add_argument('--split-contigs', action='store_true', help='Write one pooled file per contig')
 
 argsin = parser.parse_args()
 filin = argsin.pathin
@@ -45,12 +52,18 @@ print('Input file = {}'.format(os.path.expanduser(argsin.pathin)))
 print('Output file = {}'.format(os.path.expanduser(argsin.pathout)))
 print('\n'.rjust(80, '*'))
 
-# make sure to write to .vcf
+# make sure to write to .vcf, the output format is given by the extension (.vcf.gz or .bcf)
+outformat = 'bcf' if filout.endswith('.bcf') else 'vcf'
 if filout.endswith('.gz'):
     vcfout = filout[:-3]
+elif filout.endswith('.bcf'):
+    vcfout = filout[:-4] + '.vcf'
+else:
+    vcfout = filout
 
 ### SIMULATE POOLING
 start = timeit.default_timer()
-poolvcf.pysam_pooler(filin, vcfout, plookup, os.getcwd())
+poolvcf.pysam_pooler(filin, vcfout, plookup, os.getcwd(), processes=argsin.processes, out_format=outformat,
+                     checkpoint_dir=argsin.checkpoint_dir, split_contigs=argsin.split_contigs)
 
 print('\r\nTime elapsed --> ', timeit.default_timer() - start)
@@ -62,14 +62,15 @@ def create_ref_imp_lists(cd: str, sizeref: int = prm.NB_REF, sizeimp: int = prm.
     """
     print('Set size for REF (reference panel): ', sizeref)
     print('Set size for IMP (study population): ', sizeimp)
-    samples_files = ['cat {}/ALL.chr20.snps.allID.txt '.format(prm.WD + '/gt')
-                     + '| head -{} > {}/ALL.chr20.snps.impID.txt'.format(sizeimp, prm.WD + '/gt'),
-                     'cat {}/ALL.chr20.snps.allID.txt '.format(prm.WD + '/gt')
-                     + '| head -{} | tail -{} > {}/ALL.chr20.snps.refID.txt'.format(sizeimp + sizeref,
-                                                                                    sizeref,
-                                                                                    prm.WD + '/gt'),
-                     'dos2unix {}/ALL.chr20.snps.refID.txt'.format(prm.WD + '/gt'),
-                     'dos2unix {}/ALL.chr20.snps.impID.txt'.format(prm.WD + '/gt')]
+    path_ids = dict((key, os.path.join(prm.WD, 'gt', name)) for key, name in prm.SAMPLES_ID.items())
+    samples_files = ['cat {} '.format(path_ids['all'])
+                     + '| head -{} > {}'.format(sizeimp, path_ids['imp']),
+                     'cat {} '.format(path_ids['all'])
+                     + '| head -{} | tail -{} > {}'.format(sizeimp + sizeref,
+                                                          sizeref,
+                                                          path_ids['ref']),
+                     'dos2unix {}'.format(path_ids['ref']),
+                     'dos2unix {}'.format(path_ids['imp'])]
     for f in samples_files:
         subprocess.run(f, shell=True, cwd=cd)
 
@@ -81,7 +82,7 @@ def partition_imp(tpl: Tuple[str, Dict[str, str]], total_ref: bool = False) -> N
     delete_file(os.path.join(folder, dic['imp'] + '.csi'))
     pybcf.sampling(dic['gz'],
                    dic['imp'],
-                      '{}/ALL.chr20.snps.impID.txt'.format(prm.WD + '/gt'),
+                      os.path.join(prm.WD, 'gt', prm.SAMPLES_ID['imp']),
                    folder)
 
     if total_ref and dic.name != 'raw':
@@ -95,7 +96,7 @@ def partition_imp(tpl: Tuple[str, Dict[str, str]], total_ref: bool = False) -> N
 def partition_ref(dic: dict,  path: str) -> None:
     pybcf.sampling(dic['gz'].replace('.gl', '.gt'),
                    dic['ref'].replace('.gl', '.gt'),
-                      '{}/ALL.chr20.snps.refID.txt'.format(prm.WD + '/gt'),
+                      os.path.join(prm.WD, 'gt', prm.SAMPLES_ID['ref']),
                    path)
     pybcf.index(dic['ref'].replace('.gl', '.gt'), path)
 
@@ -267,7 +268,7 @@ def conform_gt(dic: dict, dicraw: dict, cd: str) -> bool:
 
     cfgt = ' '.join(['java -jar {}'.format(prm.CFGT_JAR),
                      '{}='.format('gt') + dic['b1'] + '.vcf.gz',
-                     'chrom=20:60343-62965354',
+                     'chrom={}'.format(prm.CHROM),
                      'ref={}'.format(os.path.join(cd,
                                                   dicraw['b1r'] + '.vcf.gz')),
                      'out=' + dic['cfgt']
@@ -375,17 +376,18 @@ def merge_files(pattern: str, f_out: str, cd: str):
 
 
 def concat_files(flist: list, f_out: str, dic: dict, cd: str):
-    rechr20pos = re.compile(r'(20\:)(\d+)')
+    rechrpos = re.compile(r'({}\:)(\d+)'.format(re.escape(prm.CHROM)))
     poslist: list = []
     for f in flist:
         dirpath = os.path.dirname(f)
         os.chdir(os.path.join(cd, dirpath))
-        pos = re.search(rechr20pos, f)[0]
+        match = re.search(rechrpos, f)
+        pos = match[0]
         poslist.append(pos)
 
         delete_file(f + '.csi')
         variant = ' '.join(['bcftools view',
-                            '-i POS={}'.format(pos[3:]),  # trim 20: from the regex
+                            '-i POS={}'.format(match[2]),  # position without the chromosome
                             '-Oz -o',
                             'marker_{}.vcf.gz'.format(pos),
                             dic['gtonly'] + '.vcf.gz'
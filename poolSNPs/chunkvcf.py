@@ -1,5 +1,6 @@
 import sys, os
 import pysam
+from typing import *
 
 rootdir = os.path.dirname(os.path.dirname(os.getcwd()))
 sys.path.insert(0, rootdir)
@@ -46,61 +47,101 @@ class PysamVariantCallGenerator(object):
 
 class PysamVariantChunkGenerator(object):
     """
-    Generates chunks of single-type formatted calls of variants
+    Generates chunks of single-type formatted calls of variants.
+    The file is read in a single pass: chunks are consecutive and non-overlapping, and never span several contigs.
     """
 
     def __init__(self, vcfpath: FilePath, format: str = None, chunksize: int = None):
         """
         :param vcfpath:
-        :param indextype: identifier for variants: 'id', 'chrom:pos'.
-        Must be 'chrom:pos' if the input has been generated by Phaser
+        :param chunksize: maximal number of variants in a chunk, one chunk per contig if None
         """
         self.path = vcfpath
         self.fmt = format
         self.chksz = chunksize
-        self.chrom = [*pysam.VariantFile(self.path).header.contigs][0]
-        # extract chrom, works if only 1 chrom in the file
-        self.pack = True
-        self.newpos = 1  # for valid self.newpos - 1 at the start of the first chunk
-
-    def chunk(self, chunksize: int, newpos: int):
-        """Build generators of variants calls"""
-        iterator = pysam.VariantFile(self.path)
-        try:
-            for i, v in enumerate(iterator.fetch(contig=self.chrom, start=newpos - 1, reopen=False)):
-                # newpos - 1: avoids first variant truncation in the next chunk
-                var = v
-                if i == chunksize:
-                    break
-                yield var
-
-        except StopIteration:
-            print('Could not build chunk')
-
-    def incrementer(self, chunksize: int):
-        """update position and packing bool"""
-        iterator = pysam.VariantFile(self.path)
-        try:
-            for i, v in enumerate(iterator.fetch(contig=self.chrom, start=self.newpos - 1, reopen=False)):
-                # self.newpos - 1: avoids first variant truncation in the next chunk
-                var = v
-                if i == chunksize:
-                    self.newpos = var.pos
-                    break
-            if var.pos != self.newpos:  # reached EOF
-                self.pack = False
-
-        except StopIteration:
-            self.newpos = None
-            self.pack = False
-
-        finally:
-            return self.newpos, self.pack
-
-    def chunkpacker(self):
-        while self.pack:
-            chk = self.chunk(self.chksz, self.newpos)
-            # function output and included sttributes updates NOT unpacked hence NOT updated
-            self.newpos, self.pack = self.incrementer(self.chksz)
+        self.chroms = get_contigs(self.path)
+
+    def _records(self, vcfobj: pysam.VariantFile) -> Iterator[pysam.VariantRecord]:
+        return vcfobj.fetch() if vcfobj.index is not None else iter(vcfobj)
+
+    def chunkpacker(self) -> Iterator[List[pysam.VariantRecord]]:
+        """Build chunks of variants from one open file"""
+        vcfobj = pysam.VariantFile(self.path)
+        chk = []
+        for var in self._records(vcfobj):
+            if len(chk) == self.chksz or (len(chk) > 0 and var.chrom != chk[-1].chrom):
+                yield chk
+                chk = []
+            chk.append(var)
+        if len(chk) > 0:
             yield chk
-            print(self.newpos, self.pack)
+
+    def boundaries(self) -> List[Tuple[str, int, int]]:
+        """
+        Chunks boundaries computed with one light scan of the file (samples are not parsed).
+        Variants at the same position are kept in the same chunk, such that the chunks do not overlap.
+        :return: contig, first and last positions (1-based, inclusive) of every chunk
+        """
+        vcfobj = pysam.VariantFile(self.path, drop_samples=True)
+        bounds = []
+        chrom, first, last, n = None, None, None, 0
+        for var in self._records(vcfobj):
+            if var.chrom != chrom or (self.chksz is not None and n >= self.chksz and var.pos != last):
+                if chrom is not None:
+                    bounds.append((chrom, first, last))
+                chrom, first, n = var.chrom, var.pos, 0
+            last = var.pos
+            n += 1
+        if chrom is not None:
+            bounds.append((chrom, first, last))
+        return bounds
+
+    def regions(self) -> List[str]:
+        """
+        Chunks as region strings 'contig:first-last', e.g. for workers fetching their own chunk.
+        A region also fetches variants overlapping it from the previous chunk (e.g. deletions):
+        a worker keeps only the variants with a position in its region.
+        """
+        return ['{}:{}-{}'.format(*bounds) for bounds in self.boundaries()]
+
+
+def get_contigs(vcfpath: FilePath) -> List[str]:
+    """
+    Contigs with variants in a VCF file, in file order.
+    Read from the index if the file is indexed, else from the header.
+    """
+    vcfobj = pysam.VariantFile(vcfpath)
+    if vcfobj.index is not None:
+        return list(vcfobj.index.keys())
+    return list(vcfobj.header.contigs)
+
+
+if __name__ == '__main__':
+    # Regions of a file with variants sharing positions cover every record exactly once
+    import tempfile
+
+    tmpdir = tempfile.mkdtemp()
+    path = os.path.join(tmpdir, 'dup.vcf')
+    positions = [10, 20, 20, 20, 30, 40, 50, 60, 70, 80, 90]
+    with open(path, 'w') as f_out:
+        f_out.write('##fileformat=VCFv4.2\n##contig=<ID=1>\n'
+                    '##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">\n'
+                    '#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tS1\n')
+        for i, pos in enumerate(positions):
+            f_out.write('1\t{}\tv{}\tA\tC\t.\tPASS\t.\tGT\t0|1\n'.format(pos, i))
+    path = pysam.tabix_index(path, preset='vcf', csi=True, force=True)
+    for chunksize in [1, 2, 3, 4, None]:
+        chunker = PysamVariantChunkGenerator(path, 'GT', chunksize)
+        bounds = chunker.boundaries()
+        vcfobj = pysam.VariantFile(path)
+        fetched = [var.id for chrom, first, last in bounds
+                   for var in vcfobj.fetch(region='{}:{}-{}'.format(chrom, first, last)) if var.pos >= first]
+        assert fetched == ['v{}'.format(i) for i in range(len(positions))], (chunksize, bounds)
+        if chunksize is not None:
+            assert len(bounds) > 1, (chunksize, bounds)
+        packed = [var.id for chk in chunker.chunkpacker() for var in chk]
+        assert packed == fetched
+        print(chunksize, bounds)
+    delete_file(path)
+    delete_file(path + '.csi')
+    os.rmdir(tmpdir)
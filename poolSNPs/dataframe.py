@@ -1,13 +1,17 @@
 import os, sys
+import queue
+import threading
 import pysam
 import pandas as pd
 import numpy as np
 from scipy.stats import *
+from typing import *
 
 rootdir = os.path.dirname(os.path.dirname(os.getcwd()))
 sys.path.insert(0, rootdir)
 
-from VCFPooling.poolSNPs import chunkvcf as chkvcf
+from VCFPooling.poolSNPs import gtstore
+from VCFPooling.poolSNPs.gtreader import parse_lines, trinary_encoding
 from VCFPooling.persotools.files import *
 
 """
@@ -20,62 +24,178 @@ class PandasMixedVCF(object):
     """
     Pandas objects and methods for manipulating VCF files. Any format.
     Implements pysam methods into Pandas structures.
-    Drawback: extremely slow...
+    Columns are parsed at their first access and cached: later access to the properties does not read the file again.
+    Columns requested together at initialization are parsed in one pass (see read).
+    Files too large to be loaded at once can be read lazily in chunks of variants (see iter_chunks).
+    Parsing with pysam is slow, unless the file is read from its genotype store (see gtstore),
+    which is memory-mapped after a one-time conversion.
     """
-    def __init__(self, vcfpath: FilePath, format: str = None, indextype: str = 'id'):
+    def __init__(self, vcfpath: FilePath, format: str = None, indextype: str = 'id', store: bool = False,
+                 columns: List[str] = None, batch_size: int = 1000):
         """
         :param vcfpath:
         :param indextype: identifier for variants: 'id', 'chrom:pos'.
         Must be 'chrom:pos' if the input has been generated by Phaser
+        :param store: read variants and genotypes from the store of the file, converted if needed
+        :param columns: columns parsed together at the first access to any of them, among COLUMNS.
+        Per default every column is parsed alone at its first access
+        :param batch_size: number of variants parsed at once, and per chunk in iter_chunks
         """
         self.path = vcfpath
         self.fmt = format
         self.idx = indextype
-        obj = pysam.VariantFile(self.path)
-        self.samples = list(obj.header.samples)
+        self.store = gtstore.open_store(self.path) if store else None
+        if self.store is not None:
+            self.samples = list(self.store.samples)
+        else:
+            obj = pysam.VariantFile(self.path)
+            self.samples = list(obj.header.samples)
+        self.columns = [] if columns is None else list(columns)
+        assert all(col in self.COLUMNS for col in self.columns), 'Columns must be in {}'.format(self.COLUMNS)
+        self.batch_size = batch_size
+        self._cache = {}
+
+    COLUMNS = ('variants', 'af_info', 'phases', 'genotypes', 'trinary_encoding')
 
     def load(self):
         # object returned can be read only once
         return pysam.VariantFile(self.path)
 
+    def read(self, columns: List[str] = None) -> None:
+        """
+        Parses the columns which are not cached yet in one pass over the file, and caches them.
+        :param columns: columns to read, the columns requested at initialization per default
+        """
+        columns = [col for col in (self.columns if columns is None else columns) if col not in self._cache]
+        if len(columns) == 0:
+            return
+        # the memory-mapped store is read at once, without copy
+        chunks = list(self._parse_chunks(columns, self.store.n_variants if self.store is not None else None))
+        if len(chunks) == 0:  # no variants
+            chunks = [self._records_chunk(columns, [])]
+        for col in ['variants'] + columns:
+            if col == 'variants':
+                if 'variants' not in self._cache:
+                    self._cache['variants'] = chunks[0]['variants'].append([c['variants'] for c in chunks[1:]])
+            elif len(chunks) == 1:
+                self._cache[col] = chunks[0][col]
+            else:
+                self._cache[col] = pd.concat([c[col] for c in chunks])
+
+    def iter_chunks(self, column: str = None, chunksize: int = None, as_array: bool = False,
+                    prefetch: bool = True) -> Iterator[Union[pd.Index, pd.DataFrame, np.ndarray]]:
+        """
+        Reads the file lazily in chunks of consecutive variants, such that files of any size are processed
+        in bounded memory. Chunks are indexed as the whole column e.g. by the variants identifiers.
+        A cached column is sliced instead of read again.
+        :param column: column to read, among COLUMNS. Per default trinary_encoding for GT, else genotypes
+        :param chunksize: number of variants per chunk, batch_size per default
+        :param as_array: yields the values of the chunks as NumPy arrays instead of pandas objects
+        :param prefetch: parses the next chunk in a background thread while the current chunk is processed
+        """
+        column = column if column is not None else ('trinary_encoding' if self.fmt == 'GT' else 'genotypes')
+        assert column in self.COLUMNS, 'Columns must be in {}'.format(self.COLUMNS)
+        chunksize = self.batch_size if chunksize is None else chunksize
+        if column in self._cache:
+            cached = self._cache[column]
+            chunks = (cached[start:start + chunksize] for start in range(0, len(cached), chunksize))
+        else:
+            chunks = (chunk[column] for chunk in self._parse_chunks([column], chunksize))
+            if prefetch:
+                chunks = prefetched(chunks)
+        for chunk in chunks:
+            yield np.asarray(chunk) if as_array else chunk
+
+    def _parse_chunks(self, columns: List[str], chunksize: int = None) -> Iterator[dict]:
+        """
+        Parses consecutive chunks of variants
+        :param columns: columns to parse
+        :param chunksize: number of variants per chunk, batch_size per default
+        :return: columns of every chunk, with the variants identifiers of the chunk
+        """
+        chunksize = self.batch_size if chunksize is None else chunksize
+        if self.store is not None:
+            for start in range(0, self.store.n_variants, max(1, chunksize)):
+                yield self._store_chunk(columns, start, start + chunksize)
+            return
+        records = []
+        for var in self.load():
+            records.append(var)
+            if len(records) == chunksize:
+                yield self._records_chunk(columns, records)
+                records = []
+        if len(records) > 0:
+            yield self._records_chunk(columns, records)
+
+    def _records_chunk(self, columns: List[str], records: List[pysam.VariantRecord]) -> dict:
+        """Columns parsed from pysam records"""
+        if self.idx == 'chrom:pos':
+            vars = [':'.join([str(var.chrom), str(var.pos)]) for var in records]
+        else:
+            vars = [var.id for var in records]
+        index = pd.Index(data=vars, dtype=str, name='variants')
+        chunk = {'variants': index}
+        if 'af_info' in columns:
+            af = np.asarray([var.info['AF'][0] if 'AF' in var.info else np.nan for var in records], dtype=float)
+            chunk['af_info'] = pd.DataFrame(af, index=index, columns=['af_info'], dtype=float)
+        if 'phases' in columns:
+            # TODO: if fmt GT
+            arr = np.zeros((len(index), len(self.samples)), dtype=float)
+            chunk['phases'] = pd.DataFrame(arr, index=index, columns=self.samples, dtype=bool)
+        if 'genotypes' in columns:
+            calls = [[g[self.fmt] for g in var.samples.values()] for var in records]
+            chunk['genotypes'] = pd.DataFrame(calls, index=index.rename('id'), columns=self.samples)
+        if 'trinary_encoding' in columns:
+            assert self.fmt == 'GT', 'Trinary encoding from other formats than GT not implemented'
+            # GT of the chunk parsed and encoded at once, missing are encoded as -1
+            arr = trinary_encoding(*parse_lines([str(var) for var in records], len(self.samples))[1:])
+            chunk['trinary_encoding'] = pd.DataFrame(arr, index=index, columns=self.samples)
+        return chunk
+
+    def _store_chunk(self, columns: List[str], start: int, stop: int) -> dict:
+        """Columns of a range of variants in the genotype store of the file"""
+        if self.idx == 'chrom:pos':
+            vars = [':'.join([chrom, str(pos)])
+                    for chrom, pos in zip(self.store.text('chrom', start, stop), self.store.pos[start:stop])]
+        else:
+            vars = self.store.text('id', start, stop)
+        index = pd.Index(data=vars, dtype=str, name='variants')
+        chunk = {'variants': index}
+        if 'af_info' in columns:
+            chunk['af_info'] = pd.DataFrame(self.store.af[start:stop], index=index, columns=['af_info'], dtype=float)
+        if 'phases' in columns:
+            arr = np.zeros((len(index), len(self.samples)), dtype=float)
+            chunk['phases'] = pd.DataFrame(arr, index=index, columns=self.samples, dtype=bool)
+        if 'genotypes' in columns:
+            lines = store_calls(self.store, self.fmt, start, stop)
+            chunk['genotypes'] = pd.DataFrame(lines, index=index.rename('id'), columns=self.samples)
+        if 'trinary_encoding' in columns:
+            # missing are stored as -1
+            chunk['trinary_encoding'] = pd.DataFrame(self.store.get('dosage', slice(start, stop)), index=index,
+                                                     columns=self.samples)
+        return chunk
+
+    def _get(self, column: str) -> Union[pd.Index, pd.DataFrame]:
+        if column not in self._cache:
+            # the columns requested together are read in the same pass
+            self.read(self.columns + [column] if column in self.columns else [column])
+        return self._cache[column]
+
     @property
     def variants(self) -> pd.Index:
         """
         Read variants identifiers ordered as in the input file
         :return:
         """
-        vcfobj = self.load()
-        vars = []
-        if self.idx == 'id':
-            for var in vcfobj:
-                vars.append(var.id)
-        if self.idx == 'chrom:pos':
-            for var in vcfobj:
-                vars.append(':'.join([str(var.chrom), str(var.pos)]))
-
-        return pd.Index(data=vars, dtype=str, name='variants')
+        return self._get('variants')
 
     @property
     def af_info(self):
-        vcfobj = self.load()
-        vars = self.variants
-        arr = np.zeros((len(vars), ), dtype=float)
-        for i, var in enumerate(vcfobj):
-            arr[i] = var.info['AF'][0]
-
-        return pd.DataFrame(arr, index=vars, columns=['af_info'], dtype=float)
+        return self._get('af_info')
 
     @property
     def phases(self) -> pd.DataFrame:
-        # TODO: if fmt GT
-        vcfobj = self.load()
-        vars = self.variants
-        arr = np.zeros((len(vars), len(self.samples)), dtype=float)
-        for i, var in enumerate(vcfobj):
-            pass
-            # arr[i, :] = var.gt_phases
-
-        return pd.DataFrame(arr, index=vars, columns=self.samples, dtype=bool)
+        return self._get('phases')
 
     def vcf2dframe(self) -> tuple:
         # TODO: deprecate
@@ -100,25 +220,69 @@ class PandasMixedVCF(object):
        Throws the formatted genotypes values of a VCF file into a DataFrame.
        :return: DataFrame
        """
-        lines = chkvcf.PysamVariantCallGenerator(self.path, format=self.fmt)
-        df = pd.DataFrame(lines, index=self.variants.rename('id'), columns=self.samples)
-
-        return df
+        return self._get('genotypes')
 
     def trinary_encoding(self) -> pd.DataFrame:
-        # TODO: fmt GT only!
-        vcfobj = self.load()
-        vars = self.variants
-        arr = np.empty((len(vars), len(self.samples)), dtype=float)
-        missing = np.vectorize(lambda x: np.nan if x is None else x)
-        for i, var in enumerate(vcfobj):
-            # missing are read as None
-            gts = np.array([g[self.fmt] for g in var.samples.values()]).astype(float)
-            tri = missing(gts).sum(axis=-1)
-            arr[i, :] = np.nan_to_num(tri, nan=-1)
-        dftrinary = pd.DataFrame(arr, index=vars, columns=self.samples, dtype=int)
+        """
+        Sum of alleles of the GT genotypes as int8, -1 for missing genotypes
+        """
+        return self._get('trinary_encoding')
+
+
+def store_calls(store: gtstore.GenotypeStore, format: str, start: int = 0, stop: int = None) -> List[list]:
+    """
+    Formatted calls of a range of variants in a store, as pysam returns them (tuples, None for missing values).
+    Missing calls and haploid calls have as many values as the other calls e.g. (None, None, None), (1, None).
+    """
+    key = format.lower()
+    arr = store.get(key, slice(start, stop))
+    if key == 'gt':
+        return [[tuple(None if a < 0 else a for a in g) for g in var] for var in arr.tolist()]
+    missing = lambda x: None if x != x else x  # NaN
+    if arr.ndim == 2:  # DS, 1 value per ALT allele
+        return [[(missing(x),) for x in var] for var in arr.tolist()]
+    return [[tuple(missing(x) for x in g) for g in var] for var in arr.tolist()]
+
+
+def prefetched(chunks: Iterator, depth: int = 1) -> Iterator:
+    """
+    Iterates over chunks produced in a background thread, at most depth chunks ahead of the consumer.
+    Errors raised while producing the chunks are raised again in the consumer.
+    """
+    buffer = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    done = object()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False  # the consumer stopped iterating
+
+    def produce():
+        try:
+            for chunk in chunks:
+                if not put((chunk, None)):
+                    return
+            put((done, None))
+        except BaseException as e:  # raised again in the consumer
+            put((None, e))
 
-        return dftrinary
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            chunk, error = buffer.get()
+            if error is not None:
+                raise error
+            if chunk is done:
+                return
+            yield chunk
+    finally:
+        stop.set()
 
 
 if __name__=='__main__':
@@ -0,0 +1,186 @@
+import sys, os
+import re
+import numpy as np
+import pysam
+from typing import *
+
+rootdir = os.path.dirname(os.path.dirname(os.getcwd()))
+sys.path.insert(0, rootdir)
+
+from VCFPooling.persotools.files import FilePath
+
+"""
+Columnar reader for GT genotypes in VCF files.
+Genotypes of a batch of variants are read at once as an int8 array with shape (variants, samples, 2)
+instead of per-sample lookups in pysam records.
+Missing alleles (and the second allele of haploid calls) are set to -1 and flagged in a boolean mask.
+Each batch comes with a parallel structured array of site metadata, including the raw fixed columns
+CHROM to INFO of the records as they are written in the file.
+"""
+
+SITE_DTYPE = np.dtype([('chrom', object),
+                       ('pos', np.int64),
+                       ('id', object),
+                       ('ref', object),
+                       ('alt', object),
+                       ('fixed', object)])
+
+# first two alleles of the GT subfield of every sample column, the second one empty for haploid calls
+_GT_FIELD = re.compile('(?:^|\t)([^\t:|/]*)(?:[|/]([^\t:|/]*))?')
+_DIGIT0, _MISSING, _TAB, _COLON = ord('0'), ord('.'), ord('\t'), ord(':')
+_PHASED, _UNPHASED = ord('|'), ord('/')
+
+
+class GenotypeBatch(NamedTuple):
+    """Genotypes and metadata of consecutive variants"""
+    gt: np.ndarray  # alleles, int8 (variants, samples, 2), -1 for missing
+    missing: np.ndarray  # missing alleles, bool (variants, samples, 2)
+    sites: np.ndarray  # site metadata, SITE_DTYPE (variants,)
+    records: List[pysam.VariantRecord]  # records read, empty if not read from a VCF file
+
+    def __len__(self):
+        return len(self.sites)
+
+    @property
+    def trinary(self) -> np.ndarray:
+        """Sum of alleles, int8 (variants, samples), -1 for missing"""
+        return trinary_encoding(self.gt, self.missing)
+
+
+def parse_gt_fast(samples_txt: str, n_samples: int) -> Union[np.ndarray, None]:
+    """
+    Parses sample columns where every GT call has exactly 3 characters, e.g. '0|1', '1/1', './.',
+    followed or not by other keys of the format e.g. '0|1:0.98:0.01,0.99,0'.
+    :param samples_txt: tab-separated sample columns of a VCF line, without the trailing newline
+    :param n_samples: number of samples
+    :return: allele characters (samples, 2) as uint8, None if the columns do not have the expected layout
+    """
+    if len(samples_txt) == 4 * n_samples - 1:  # GT only
+        buf = np.frombuffer((samples_txt + '\t').encode(), dtype=np.uint8).reshape((n_samples, 4))
+        calls = buf if (buf[:, 3] == _TAB).all() else None
+    else:
+        calls = None
+    if calls is None:
+        # fields start after the tabs, the GT subfield ends with a colon or a tab (padding for short fields)
+        buf = np.frombuffer((samples_txt + '\t\t\t\t').encode(), dtype=np.uint8)
+        tabs = np.flatnonzero(buf[:len(buf) - 4] == _TAB)
+        if len(tabs) != n_samples - 1:
+            return None
+        starts = np.concatenate([[0], tabs + 1])
+        calls = buf[starts[:, np.newaxis] + np.arange(4)]
+        if not ((calls[:, 3] == _TAB) | (calls[:, 3] == _COLON)).all():
+            return None
+    if not ((calls[:, 1] == _PHASED) | (calls[:, 1] == _UNPHASED)).all():
+        return None
+    alleles = calls[:, [0, 2]]
+    if not (((alleles >= _DIGIT0) & (alleles <= _DIGIT0 + 9)) | (alleles == _MISSING)).all():
+        return None
+    return alleles
+
+
+def parse_gt_slow(samples_txt: str) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Parses any sample columns with GT as first key of the format (multi-digit alleles, haploid calls...).
+    The first two alleles of every call are matched at once over the whole line.
+    :param samples_txt: tab-separated sample columns of a VCF line, without the trailing newline
+    :return: alleles (samples, 2) as int8 and missing alleles (samples, 2) as bool
+    """
+    alleles = np.asarray(_GT_FIELD.findall(samples_txt), dtype=str).reshape((-1, 2))
+    missing = (alleles == '.') | (alleles == '')  # second allele of haploid calls
+    gt = np.where(missing, '-1', alleles).astype(np.int8)
+    return gt, missing
+
+
+def parse_gt(samples_txt: str, n_samples: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Parses the GT subfield of sample columns with GT as first key of the format.
+    :param samples_txt: tab-separated sample columns of a VCF line, without the trailing newline
+    :param n_samples: number of samples
+    :return: alleles (samples, 2) as int8 and missing alleles (samples, 2) as bool
+    """
+    alleles = parse_gt_fast(samples_txt, n_samples)
+    if alleles is None:
+        return parse_gt_slow(samples_txt)
+    missing = alleles == _MISSING
+    gt = np.where(missing, -1, alleles.astype(np.int8) - _DIGIT0).astype(np.int8)
+    return gt, missing
+
+
+def parse_line(line: str, n_samples: int) -> Tuple[tuple, np.ndarray, np.ndarray]:
+    """
+    Parses a VCF data line into site metadata and genotypes.
+    :param line: VCF data line with GT as first key of the format
+    :param n_samples: number of samples
+    :return: site metadata as a SITE_DTYPE row, alleles (samples, 2) as int8, missing alleles (samples, 2)
+    """
+    cols = line.rstrip('\n').split('\t', 9)
+    assert cols[8].split(':', 1)[0] == 'GT', 'Reading other format than GT not implemented'
+    site = (cols[0], int(cols[1]), cols[2], cols[3], cols[4], '\t'.join(cols[:8]))
+    gt, missing = parse_gt(cols[9], n_samples)
+    return site, gt, missing
+
+
+def parse_lines(lines: List[str], n_samples: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Parses VCF data lines into a batch of site metadata and genotypes.
+    :param lines: VCF data lines with GT as first key of the format
+    :param n_samples: number of samples
+    :return: site metadata (variants,) as SITE_DTYPE, alleles (variants, samples, 2) as int8,
+    missing alleles (variants, samples, 2)
+    """
+    gt = np.empty((len(lines), n_samples, 2), dtype=np.int8)
+    missing = np.empty((len(lines), n_samples, 2), dtype=bool)
+    sites = np.empty(len(lines), dtype=SITE_DTYPE)
+    for i, line in enumerate(lines):
+        sites[i], gt[i], missing[i] = parse_line(line, n_samples)
+    return sites, gt, missing
+
+
+def trinary_encoding(gt: np.ndarray, missing: np.ndarray) -> np.ndarray:
+    """
+    Trinary encoding (sum of alleles) of genotypes, in bulk.
+    :param gt: alleles (..., 2) as int8
+    :param missing: missing alleles (..., 2)
+    :return: sum of alleles (...) as int8, -1 if any allele is missing
+    """
+    return np.where(missing.any(axis=-1), -1, gt.sum(axis=-1, dtype=np.int8)).astype(np.int8)
+
+
+class GenotypeReader(object):
+    """
+    Reads GT genotypes of a VCF file in batches of variants.
+    """
+    def __init__(self, vcfpath: FilePath, batch_size: int = 1000, region: Tuple[str, int, int] = None):
+        """
+        :param vcfpath: path to the VCF file (any format read by pysam)
+        :param batch_size: number of variants per batch
+        :param region: (contig, start, stop) to read from an indexed file, the whole file per default
+        """
+        self.path = vcfpath
+        self.batch_size = batch_size
+        self.region = region
+
+    @property
+    def samples(self) -> List[str]:
+        """Samples in the input VCF file"""
+        return list(pysam.VariantFile(self.path).header.samples)
+
+    def records(self) -> Iterator[pysam.VariantRecord]:
+        vcfobj = pysam.VariantFile(self.path)
+        return vcfobj.fetch() if self.region is None else vcfobj.fetch(*self.region)
+
+    def read_batch(self, records: List[pysam.VariantRecord]) -> GenotypeBatch:
+        """Parses genotypes and metadata of the given records"""
+        n_samples = len(records[0].samples) if len(records) > 0 else 0
+        sites, gt, missing = parse_lines([str(rec) for rec in records], n_samples)
+        return GenotypeBatch(gt, missing, sites, records)
+
+    def __iter__(self) -> Iterator[GenotypeBatch]:
+        batch = []
+        for rec in self.records():
+            batch.append(rec)
+            if len(batch) == self.batch_size:
+                yield self.read_batch(batch)
+                batch = []
+        if len(batch) > 0:
+            yield self.read_batch(batch)
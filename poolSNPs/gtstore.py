@@ -0,0 +1,342 @@
+import sys, os
+import json
+import hashlib
+import shutil
+import timeit
+import numpy as np
+import pysam
+from typing import *
+
+rootdir = os.path.dirname(os.path.dirname(os.getcwd()))
+sys.path.insert(0, rootdir)
+
+from VCFPooling.poolSNPs.gtreader import SITE_DTYPE, GenotypeBatch, parse_gt, trinary_encoding
+from VCFPooling.poolSNPs.pooler import lookup_cache_dirs
+from VCFPooling.persotools.files import FilePath
+
+"""
+On-disk genotype store: a VCF file is converted once into flat binary arrays which are memory-mapped when read,
+such that evaluations run repeatedly on the same files do not parse text VCF again.
+A store is a directory with:
+* meta.json: samples, number of variants, arrays and source file (size and modification time),
+* <name>.bin: raw arrays with variants as first axis, for genotypes
+    - gt: alleles, int8 (variants, samples, 2), -1 for missing
+    - dosage: sum of alleles (trinary encoding), int8 (variants, samples), -1 if any allele is missing
+    - gl, gp: float32 (variants, samples, 3), NaN for missing
+    - ds: float32 (variants, samples), NaN for missing
+  and for variants metadata: pos (int64), af (float32, first ALT allele, NaN if missing),
+* <name>.txt and <name>.off.bin: text columns chrom, id, ref, alt and fixed (raw columns CHROM to INFO),
+one line per variant, with the offsets (int64, variants + 1) of the lines.
+Slicing a memory-mapped array by variants and samples ranges does not copy data.
+A store is written next to its VCF file, or in a user cache directory if the directory of the file
+is read-only (see store_paths).
+"""
+
+META = 'meta.json'
+VERSION = 1
+FLOAT_FORMATS = {'GL': 3, 'GP': 3, 'DS': 1}  # values per sample
+TEXT_COLUMNS = ('chrom', 'id', 'ref', 'alt', 'fixed')
+
+
+def store_path(vcfpath: FilePath) -> str:
+    """Default path to the store of a VCF file e.g. <file>.vcf.gz.gts"""
+    return str(vcfpath) + '.gts'
+
+
+def store_paths(vcfpath: FilePath) -> List[str]:
+    """
+    Paths to the store of a VCF file, in order of preference: store_path next to the file,
+    then in the cache directories of the compiled lookup tables (see pooler.lookup_cache_dirs).
+    In a cache directory, the store is named after the file and a hash of its absolute path
+    e.g. <file>.vcf.gz.<hash>.gts, such that files with the same name in different directories do not collide.
+    """
+    vcfpath = os.path.abspath(vcfpath)
+    digest = hashlib.sha1(vcfpath.encode()).hexdigest()[:16]
+    name = '{}.{}.gts'.format(os.path.basename(vcfpath), digest)
+    return [store_path(vcfpath)] + [os.path.join(cdir, name) for cdir in lookup_cache_dirs(vcfpath)[1:]]
+
+
+def source_stamp(vcfpath: FilePath) -> dict:
+    """Identifies the version of the VCF file a store is converted from"""
+    return {'path': os.path.abspath(vcfpath),
+            'size': os.path.getsize(vcfpath),
+            'mtime': os.path.getmtime(vcfpath)}
+
+
+def parse_float_field(sample_cols: List[str], key: int, n_values: int) -> np.ndarray:
+    """
+    Parses a float field of every sample e.g. GL values.
+    :param sample_cols: sample columns of a VCF line
+    :param key: index of the field in the format
+    :param n_values: number of values per sample
+    :return: values as float32 (samples, values), NaN for missing values
+    """
+    missing = ','.join(['.'] * n_values)
+    fields = []
+    for col in sample_cols:
+        keys = col.split(':')
+        fields.append(keys[key] if key < len(keys) and keys[key] != '.' else missing)  # trailing fields can be dropped
+    values = ','.join(fields).split(',')
+    assert len(values) == len(sample_cols) * n_values, 'Expected {} values per sample'.format(n_values)
+    return np.asarray([v if v != '.' else 'nan' for v in values]).astype(np.float32).reshape((-1, n_values))
+
+
+def parse_af(info: str) -> float:
+    """Frequency of the first ALT allele in the INFO column, NaN if missing"""
+    for field in info.split(';'):
+        if field.startswith('AF='):
+            af = field[3:].split(',')[0]
+            return np.nan if af == '.' else float(af)
+    return np.nan
+
+
+def vcf_formats(vcfpath: FilePath) -> List[str]:
+    """Formats in the header of a VCF file which can be stored"""
+    formats = list(pysam.VariantFile(vcfpath).header.formats)
+    return [fmt for fmt in ['GT'] + list(FLOAT_FORMATS.keys()) if fmt in formats]
+
+
+class StoreWriter(object):
+    """
+    Appends batches of variants to the files of a store
+    """
+    def __init__(self, path: str, samples: List[str], formats: List[str]):
+        self.path = path
+        self.samples = samples
+        self.formats = formats
+        self.n_variants = 0
+        self.arrays = {'pos': (np.int64, ()), 'af': (np.float32, ())}
+        if 'GT' in formats:
+            self.arrays.update({'gt': (np.int8, (len(samples), 2)), 'dosage': (np.int8, (len(samples),))})
+        for fmt in formats:
+            if fmt in FLOAT_FORMATS:
+                n_values = FLOAT_FORMATS[fmt]
+                self.arrays[fmt.lower()] = (np.float32, (len(samples), n_values) if n_values > 1 else (len(samples),))
+        self.files = dict((name, open(os.path.join(path, name + '.bin'), 'wb')) for name in self.arrays)
+        self.texts = dict((name, open(os.path.join(path, name + '.txt'), 'wb')) for name in TEXT_COLUMNS)
+        self.offsets = dict((name, open(os.path.join(path, name + '.off.bin'), 'wb')) for name in TEXT_COLUMNS)
+        self.text_size = dict((name, 0) for name in TEXT_COLUMNS)
+        for f_off in self.offsets.values():
+            f_off.write(np.zeros(1, dtype=np.int64).tobytes())
+
+    def append(self, lines: List[str]) -> None:
+        """Parses and appends lines of VCF data"""
+        n_samples = len(self.samples)
+        columns = dict((name, np.empty((len(lines),) + shape, dtype=dtype))
+                       for name, (dtype, shape) in self.arrays.items())
+        texts = dict((name, []) for name in TEXT_COLUMNS)
+        for i, line in enumerate(lines):
+            cols = line.rstrip('\n').split('\t', 9)
+            for name, txt in zip(TEXT_COLUMNS, [cols[0], cols[2], cols[3], cols[4], '\t'.join(cols[:8])]):
+                texts[name].append(txt)
+            columns['pos'][i] = int(cols[1])
+            columns['af'][i] = parse_af(cols[7])
+            keys = cols[8].split(':') if len(cols) > 8 else []
+            sample_cols = cols[9].split('\t') if len(cols) > 9 else []
+            if 'GT' in self.formats:
+                if len(keys) > 0 and keys[0] == 'GT':
+                    gt, missing = parse_gt(cols[9], n_samples)
+                else:
+                    gt = np.full((n_samples, 2), -1, dtype=np.int8)
+                    missing = np.ones((n_samples, 2), dtype=bool)
+                columns['gt'][i] = gt
+                columns['dosage'][i] = trinary_encoding(gt, missing)
+            for fmt in self.formats:
+                if fmt in FLOAT_FORMATS:
+                    n_values = FLOAT_FORMATS[fmt]
+                    if fmt in keys:
+                        values = parse_float_field(sample_cols, keys.index(fmt), n_values)
+                    else:
+                        values = np.full((n_samples, n_values), np.nan, dtype=np.float32)
+                    columns[fmt.lower()][i] = values if n_values > 1 else values[:, 0]
+        for name, f_out in self.files.items():
+            f_out.write(np.ascontiguousarray(columns[name]).tobytes())
+        for name in TEXT_COLUMNS:
+            encoded = [(txt + '\n').encode() for txt in texts[name]]
+            sizes = np.cumsum([len(txt) for txt in encoded], dtype=np.int64) + self.text_size[name]
+            self.texts[name].write(b''.join(encoded))
+            self.offsets[name].write(sizes.tobytes())
+            self.text_size[name] = int(sizes[-1]) if len(sizes) > 0 else self.text_size[name]
+        self.n_variants += len(lines)
+
+    def close(self, source: dict) -> None:
+        """Closes the files and writes the metadata of the store"""
+        for f_out in list(self.files.values()) + list(self.texts.values()) + list(self.offsets.values()):
+            f_out.close()
+        meta = {'version': VERSION,
+                'source': source,
+                'samples': self.samples,
+                'n_variants': self.n_variants,
+                'arrays': dict((name, {'dtype': np.dtype(dtype).str, 'shape': [self.n_variants] + list(shape)})
+                               for name, (dtype, shape) in self.arrays.items()),
+                'texts': list(TEXT_COLUMNS)}
+        with open(os.path.join(self.path, META), 'w') as f:
+            json.dump(meta, f, indent=1)
+
+
+def convert_vcf(vcfpath: FilePath, path: str = None, formats: List[str] = None,
+                batch_size: int = 1000) -> 'GenotypeStore':
+    """
+    Converts a VCF file into a genotype store, in one pass over the file.
+    The store is written to a temporary directory first, and replaces any existing store when complete.
+    :param vcfpath: path to the VCF file (any format read by pysam)
+    :param path: path to the store. Per default, the first writable one of store_paths
+    :param formats: formats to store among GT, GL, GP, DS, all formats of the header per default
+    :param batch_size: number of variants parsed at once
+    :return: the store opened
+    """
+    formats = vcf_formats(vcfpath) if formats is None else [fmt.upper() for fmt in formats]
+    assert all(fmt == 'GT' or fmt in FLOAT_FORMATS for fmt in formats), \
+        'Storing other formats than GT, {} not implemented'.format(', '.join(FLOAT_FORMATS.keys()))
+    paths = store_paths(vcfpath) if path is None else [path]
+    for n, path in enumerate(paths):
+        path_tmp = '{}.{}.tmp'.format(path, os.getpid())
+        shutil.rmtree(path_tmp, ignore_errors=True)
+        try:
+            os.makedirs(path_tmp)
+            break
+        except OSError:  # e.g. read-only directory, try the next one
+            if n == len(paths) - 1:
+                raise
+    source = source_stamp(vcfpath)
+    vcfobj = pysam.VariantFile(vcfpath)
+    writer = StoreWriter(path_tmp, list(vcfobj.header.samples), formats)
+    print('Converting {} to {}'.format(vcfpath, path).ljust(80, '.'))
+    tm = timeit.default_timer()
+    batch = []
+    for rec in vcfobj.fetch() if vcfobj.index is not None else vcfobj:
+        batch.append(str(rec))
+        if len(batch) == batch_size:
+            writer.append(batch)
+            batch = []
+    if len(batch) > 0:
+        writer.append(batch)
+    writer.close(source)
+    print('{} variants converted in {:06.2f} sec'.format(writer.n_variants,
+                                                         timeit.default_timer() - tm).ljust(80, '.'))
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(path_tmp, path)
+    return GenotypeStore(path)
+
+
+def open_store(vcfpath: FilePath, path: str = None, formats: List[str] = None,
+               batch_size: int = 1000) -> 'GenotypeStore':
+    """
+    Opens the store of a VCF file. The file is converted if it has no store yet,
+    or if it has changed or has other formats than its store.
+    :param vcfpath: path to the VCF file
+    :param path: path to the store. Per default, the first one of store_paths with an up-to-date store,
+    else the first writable one
+    :param formats: formats required in the store, all formats of the VCF file per default
+    :param batch_size: number of variants parsed at once if the file is converted
+    """
+    required = vcf_formats(vcfpath) if formats is None else [fmt.upper() for fmt in formats]
+    for spath in store_paths(vcfpath) if path is None else [path]:
+        if os.path.exists(os.path.join(spath, META)):
+            store = GenotypeStore(spath)
+            if store.source == source_stamp(vcfpath) and all(fmt in store.formats for fmt in required):
+                return store
+    return convert_vcf(vcfpath, path, formats=formats, batch_size=batch_size)
+
+
+class GenotypeStore(object):
+    """
+    Memory-mapped genotypes and variants metadata of a VCF file converted with convert_vcf.
+    """
+    def __init__(self, path: str):
+        """
+        :param path: path to the store directory
+        """
+        self.path = path
+        with open(os.path.join(path, META)) as f:
+            self.meta = json.load(f)
+        assert self.meta['version'] == VERSION, 'Store version {} not supported'.format(self.meta['version'])
+        self.samples = self.meta['samples']
+        self.n_variants = self.meta['n_variants']
+        self.source = self.meta['source']
+        self._arrays = {}
+
+    @property
+    def n_samples(self) -> int:
+        return len(self.samples)
+
+    @property
+    def formats(self) -> List[str]:
+        """Formats stored"""
+        names = self.meta['arrays']
+        return (['GT'] if 'gt' in names else []) + [fmt for fmt in FLOAT_FORMATS if fmt.lower() in names]
+
+    def array(self, name: str) -> np.ndarray:
+        """
+        Memory-mapped array e.g. 'dosage', 'gl', 'pos'. Read-only, data are loaded lazily when accessed.
+        """
+        if name not in self._arrays:
+            spec = self.meta['arrays'][name]
+            if self.n_variants == 0:  # empty files cannot be mapped
+                self._arrays[name] = np.empty(spec['shape'], dtype=spec['dtype'])
+            else:
+                self._arrays[name] = np.memmap(os.path.join(self.path, name + '.bin'), dtype=spec['dtype'],
+                                               mode='r', shape=tuple(spec['shape']))
+        return self._arrays[name]
+
+    def get(self, name: str, variants: slice = slice(None), samples: slice = slice(None)) -> np.ndarray:
+        """
+        Genotypes of ranges of variants and samples, as a view of the memory-mapped array (no copy).
+        :param name: 'gt', 'dosage', 'gl', 'gp' or 'ds'
+        :param variants: range of variants e.g. slice(1000, 2000)
+        :param samples: range of samples
+        """
+        return self.array(name)[variants, samples]
+
+    def text(self, name: str, start: int = 0, stop: int = None) -> np.ndarray:
+        """
+        Text column of a range of variants e.g. 'id'
+        :return: strings of the variants, as an object array
+        """
+        stop = self.n_variants if stop is None else min(stop, self.n_variants)
+        if stop <= start:
+            return np.asarray([], dtype=object)
+        offsets = np.memmap(os.path.join(self.path, name + '.off.bin'), dtype=np.int64, mode='r')
+        blob = np.memmap(os.path.join(self.path, name + '.txt'), dtype=np.uint8, mode='r')
+        txt = blob[offsets[start]:offsets[stop]].tobytes().decode()
+        return np.asarray(txt.split('\n')[:-1], dtype=object)
+
+    @property
+    def pos(self) -> np.ndarray:
+        return self.array('pos')
+
+    @property
+    def af(self) -> np.ndarray:
+        return self.array('af')
+
+    def sites(self, start: int = 0, stop: int = None) -> np.ndarray:
+        """Variants metadata of a range of variants, as read by gtreader.GenotypeReader (SITE_DTYPE)"""
+        stop = self.n_variants if stop is None else min(stop, self.n_variants)
+        sites = np.empty(max(0, stop - start), dtype=SITE_DTYPE)
+        for name in ['chrom', 'id', 'ref', 'alt', 'fixed']:
+            sites[name] = self.text(name, start, stop)
+        sites['pos'] = self.pos[start:stop]
+        return sites
+
+    def batches(self, batch_size: int = 1000) -> Iterator[GenotypeBatch]:
+        """
+        Genotypes of consecutive variants, as read by gtreader.GenotypeReader (without the pysam records)
+        """
+        assert 'GT' in self.formats, 'No GT genotypes in the store'
+        for start in range(0, self.n_variants, batch_size):
+            stop = min(start + batch_size, self.n_variants)
+            gt = self.get('gt', slice(start, stop))
+            yield GenotypeBatch(gt, gt == -1, self.sites(start, stop), [])
+
+
+if __name__ == '__main__':
+    # Conversion of the example file and equivalence with gtreader.GenotypeReader
+    from VCFPooling.poolSNPs.gtreader import GenotypeReader
+
+    path_examples = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'examples')
+    vcf = os.path.join(path_examples, 'TEST.chr20.snps.gt.vcf.gz')
+    store = convert_vcf(vcf, path=os.path.join(os.getcwd(), 'TEST.chr20.snps.gt.gts'))
+    for batch, stored in zip(GenotypeReader(vcf, 100), store.batches(100)):
+        assert np.array_equal(batch.gt, stored.gt)
+        assert all((batch.sites[name] == stored.sites[name]).all() for name in batch.sites.dtype.names)
+    print('{} variants x {} samples stored, equal to GenotypeReader'.format(store.n_variants, store.n_samples))
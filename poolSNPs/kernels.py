@@ -0,0 +1,215 @@
+import os, sys
+import warnings
+import numpy as np
+from typing import *
+
+rootdir = os.path.dirname(os.path.dirname(os.getcwd()))
+sys.path.insert(0, rootdir)
+
+from VCFPooling.poolSNPs.pooler import Design, Encoder, Decoder, batch_lookup_keys, decode_batch_gt, get_key_weights
+
+try:
+    import numba
+except ImportError:  # JIT-compiled kernels are optional
+    numba = None
+
+"""
+Compute backends for pooling simulation on many variants at once.
+Encoding, row/column counts, cross section keys and lookup are either chained as NumPy operations
+(backend 'numpy') or fused in one compiled loop over variants and blocks (backend 'numba').
+The numba backend is used only if numba can be imported, else computations fall back to NumPy.
+The backend can be chosen with the environment variable POOLSNPS_BACKEND, or at runtime with set_backend.
+The kernels are compiled without parallel=True: numba's default threading layer is not safe to use
+from other threads than the main thread (e.g. the feeder thread of poolvcf.write_bcf or dataframe.prefetched),
+and hangs the interpreter at exit. Parallelism comes from the worker processes instead (see poolvcf.write_parallel).
+"""
+
+BACKENDS = ('numpy', 'numba')
+
+
+def _check_backend(name: str) -> str:
+    name = name.lower()
+    if name not in BACKENDS:
+        raise ValueError('Unknown backend {}, choose one of {}'.format(name, BACKENDS))
+    if name == 'numba' and numba is None:
+        warnings.warn('numba is not available, falling back to NumPy backend')
+        return 'numpy'
+    return name
+
+
+_backend = _check_backend(os.environ.get('POOLSNPS_BACKEND', 'numpy' if numba is None else 'numba'))
+
+
+def set_backend(name: str) -> str:
+    """
+    Sets the backend used for pooling and decoding.
+    :param name: 'numpy' or 'numba'
+    :return: backend actually set (NumPy if the JIT is not available)
+    """
+    global _backend
+    _backend = _check_backend(name)
+    return _backend
+
+
+def get_backend() -> str:
+    """Backend currently used for pooling and decoding"""
+    return _backend
+
+
+def resolve_backend(name: str = None) -> str:
+    """Backend to compute with: the given one (NumPy if the JIT is not available), else the current one"""
+    return get_backend() if name is None else _check_backend(name)
+
+
+if numba is not None:
+    @numba.njit(cache=True)
+    def _pool_block(dosages, offset, n_rows, n_cols, pooled):
+        """Pooled scores (0, 1, 2) of the row and column pools of the block starting at offset"""
+        for i in range(n_rows):
+            s = 0
+            for j in range(n_cols):
+                s += dosages[offset + i * n_cols + j]
+            pooled[i] = 0 if s == 0 else (2 if s == 2 * n_cols else 1)
+        for j in range(n_cols):
+            s = 0
+            for i in range(n_rows):
+                s += dosages[offset + i * n_cols + j]
+            pooled[n_rows + j] = 0 if s == 0 else (2 if s == 2 * n_rows else 1)
+
+    @numba.njit(cache=True)
+    def _rows_kernel(dosages, n_rows, n_cols, weights, lookup_index, out):
+        n_variants, n_samples = dosages.shape
+        block_size = n_rows * n_cols
+        for v in range(n_variants):
+            pooled = np.empty(n_rows + n_cols, dtype=np.int64)
+            for offset in range(0, n_samples, block_size):
+                _pool_block(dosages[v], offset, n_rows, n_cols, pooled)
+                blockkey = 0
+                for i in range(n_rows):
+                    blockkey += weights[pooled[i]]
+                for j in range(n_cols):
+                    blockkey += weights[3 + pooled[n_rows + j]]
+                for i in range(n_rows):
+                    for j in range(n_cols):
+                        lo = min(pooled[i], pooled[n_rows + j])
+                        hi = max(pooled[i], pooled[n_rows + j])
+                        out[v, offset + i * n_cols + j] = lookup_index[blockkey + lo * weights[6] + hi * weights[7]]
+
+    @numba.njit(cache=True)
+    def _gt_kernel(dosages, n_rows, n_cols, out):
+        n_variants, n_samples = dosages.shape
+        block_size = n_rows * n_cols
+        for v in range(n_variants):
+            pooled = np.empty(n_rows + n_cols, dtype=np.int64)
+            for offset in range(0, n_samples, block_size):
+                _pool_block(dosages[v], offset, n_rows, n_cols, pooled)
+                nb_alt = 0
+                nb_ref = 0
+                for p in range(n_rows + n_cols):
+                    nb_alt += pooled[p] >= 1
+                    nb_ref += pooled[p] <= 1
+                for i in range(n_rows):
+                    for j in range(n_cols):
+                        encoded = pooled[i] + pooled[n_rows + j]
+                        if nb_alt == 0:  # all RR
+                            a1, a2 = 0, 0
+                        elif nb_ref == 0:  # all AA
+                            a1, a2 = 1, 1
+                        elif nb_alt == 2:  # all RR but 1 AA or RA
+                            a1, a2 = (1, -1) if encoded == 2 else (0, 0)
+                        elif nb_ref == 2:  # symmetric case: all AA but 1 RR or RA
+                            a1, a2 = (0, -1) if encoded == 2 else (1, 1)
+                        elif encoded > 2:  # mix of RR, AA, RA/AR
+                            a1, a2 = 1, 1
+                        elif encoded < 2:
+                            a1, a2 = 0, 0
+                        else:
+                            a1, a2 = -1, -1
+                        out[v, offset + i * n_cols + j, 0] = a1
+                        out[v, offset + i * n_cols + j, 1] = a2
+
+
+def _check_samples(dosages: np.ndarray, shape: Tuple[int, int]) -> np.ndarray:
+    dosages = np.ascontiguousarray(np.atleast_2d(dosages))
+    assert dosages.shape[-1] % (shape[0] * shape[1]) == 0  # check all samples fit in some block
+    return dosages
+
+
+def pool_decode_rows(dosages: np.ndarray, shape: Tuple[int, int], lookup_index: np.ndarray,
+                     backend: str = None) -> np.ndarray:
+    """
+    Simulates pooling and decodes the pooled genotypes into rows of the lookup table.
+    :param dosages: sum of alleles in GT format, shape (variants, samples), samples in block row-major order
+    :param shape: rows and columns of a block
+    :param lookup_index: dense index of the lookup table, -1 for missing keys (see pooler.load_compiled_lookup)
+    :param backend: backend to use instead of the current one
+    :return: lookup rows with shape (variants, samples), -1 for keys missing from the table
+    """
+    shape = tuple(shape)
+    backend = resolve_backend(backend)
+    dosages = _check_samples(dosages, shape)
+    if backend == 'numba':
+        out = np.empty(dosages.shape, dtype=np.int64)
+        _rows_kernel(dosages, shape[0], shape[1], np.asarray(get_key_weights(shape), dtype=np.int64),
+                     np.asarray(lookup_index, dtype=np.int64), out)
+        return out
+    design = Design(shape=shape)
+    pooled = Encoder(design).encode_batch(dosages).sum(axis=-1)
+    keys = batch_lookup_keys(pooled.reshape((dosages.shape[0], -1, design.pools_nb)), design)
+    return np.asarray(lookup_index)[keys].reshape(dosages.shape)
+
+
+def pool_decode_gp(dosages: np.ndarray, shape: Tuple[int, int], lookup_index: np.ndarray,
+                   lookup_vals: np.ndarray, backend: str = None) -> np.ndarray:
+    """
+    Simulates pooling and decodes the pooled genotypes into adaptive GP.
+    :param dosages: sum of alleles in GT format, shape (variants, samples), samples in block row-major order
+    :param shape: rows and columns of a block
+    :param lookup_index: dense index of the lookup table, -1 for missing keys (see pooler.load_compiled_lookup)
+    :param lookup_vals: GP values of the lookup table, sentinel row last
+    :param backend: backend to use instead of the current one
+    :return: genotypes probabilities with shape (variants, samples, 3)
+    """
+    return np.asarray(lookup_vals)[pool_decode_rows(dosages, shape, lookup_index, backend=backend)]
+
+
+def pool_decode_gt(dosages: np.ndarray, shape: Tuple[int, int], backend: str = None) -> np.ndarray:
+    """
+    Simulates pooling and decodes the pooled genotypes into GT.
+    :param dosages: sum of alleles in GT format, shape (variants, samples), samples in block row-major order
+    :param shape: rows and columns of a block
+    :param backend: backend to use instead of the current one
+    :return: genotypes (unphased, -1 for missing alleles) with shape (variants, samples, 2)
+    """
+    shape = tuple(shape)
+    backend = resolve_backend(backend)
+    dosages = _check_samples(dosages, shape)
+    if backend == 'numba':
+        out = np.empty(dosages.shape + (2,), dtype=int)
+        _gt_kernel(dosages, shape[0], shape[1], out)
+        return out
+    design = Design(shape=shape)
+    pooled = Encoder(design).encode_batch(dosages).sum(axis=-1)
+    return decode_batch_gt(pooled.reshape((dosages.shape[0], -1, design.pools_nb)), design)
+
+
+if __name__ == '__main__':
+    # Equivalence of the available backends with pooler.Decoder
+    from VCFPooling.poolSNPs.pooler import get_lookup_arrays
+
+    path_examples = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'examples')
+    D, V = get_lookup_arrays(path_examples)
+    rng = np.random.default_rng(123)
+    n_blocks = 10
+    x = rng.choice(3, size=(500, 16 * n_blocks), p=[0.85, 0.1, 0.05]).astype(np.int8)
+    dm = Design(blocks=n_blocks)
+    pooled = Encoder(dm).encode_batch(x).sum(axis=-1).reshape((x.shape[0], n_blocks, -1))
+    decoder = Decoder(dm, D, V)
+    gp, gt = decoder.decode_batch_gp(pooled), decoder.decode_batch_gt(pooled)
+    for bk in BACKENDS:
+        if _check_backend(bk) != bk:
+            continue
+        assert np.array_equal(pool_decode_gp(x, (4, 4), decoder.index, decoder.vals, backend=bk), gp), \
+            '{} backend: GP differs from Decoder'.format(bk)
+        assert np.array_equal(pool_decode_gt(x, (4, 4), backend=bk), gt), '{} backend: GT differs from Decoder'.format(bk)
+        print('{} backend: GP and GT equal to Decoder'.format(bk))
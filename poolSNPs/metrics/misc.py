@@ -55,8 +55,9 @@ class Diversity(object):
     """
 
     """
-    def __init__(self, filepath: FilePath, format: str = None, idx: str = 'id'):
-        self.obj = vcfdf.PandasMixedVCF(filepath, format=format, indextype=idx)
+    def __init__(self, filepath: FilePath, format: str = None, idx: str = 'id', store: bool = False):
+        columns = ['variants', 'trinary_encoding'] if format == 'GT' else None
+        self.obj = vcfdf.PandasMixedVCF(filepath, format=format, indextype=idx, store=store, columns=columns)
         self.fmt = format
 
     def markers_diversity(self):
@@ -117,9 +117,14 @@ class QualityGT(object):
     * difference per variant and/or per sample between imputed and true genotypes
     * allele dosage
     """
-    def __init__(self, truefile: FilePath, imputedfile: FilePath, ax: object, idx: str = 'id'):
-        self.trueobj = vcfdf.PandasMixedVCF(truefile, format='GT', indextype=idx)
-        self.imputedobj = vcfdf.PandasMixedVCF(imputedfile, format='GT', indextype=idx)
+    def __init__(self, truefile: FilePath, imputedfile: FilePath, ax: object, idx: str = 'id', store: bool = False):
+        """
+        :param store: read the files from their genotype stores (see gtstore)
+        """
+        columns = ['variants', 'af_info', 'trinary_encoding']  # parsed in one pass per file
+        self.trueobj = vcfdf.PandasMixedVCF(truefile, format='GT', indextype=idx, store=store, columns=columns)
+        self.imputedobj = vcfdf.PandasMixedVCF(imputedfile, format='GT', indextype=idx, store=store,
+                                               columns=columns)
         self._axis = ax
         #TODO: index properties and verification
 
@@ -286,9 +291,15 @@ class QualityGL(object):
     """
     Implement cross-entropy method for assessing imputation performance from GL
     """
-    def __init__(self, truefile: FilePath, imputedfile: FilePath, ax: object, fmt: str = 'GP', idx: str = 'id'):
-        self.trueobj = vcfdf.PandasMixedVCF(truefile, format='GL', indextype=idx)
-        self.imputedobj = vcfdf.PandasMixedVCF(imputedfile, format=fmt, indextype=idx)
+    def __init__(self, truefile: FilePath, imputedfile: FilePath, ax: object, fmt: str = 'GP', idx: str = 'id',
+                 store: bool = False):
+        """
+        :param store: read the files from their genotype stores (see gtstore)
+        """
+        columns = ['variants', 'af_info', 'genotypes']  # parsed in one pass per file
+        self.trueobj = vcfdf.PandasMixedVCF(truefile, format='GL', indextype=idx, store=store, columns=columns)
+        self.imputedobj = vcfdf.PandasMixedVCF(imputedfile, format=fmt, indextype=idx, store=store,
+                                               columns=columns)
         self._axis = ax
         #TODO: index properties and verification
 
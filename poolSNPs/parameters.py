@@ -70,14 +70,17 @@ WD = os.path.join(DATA_PATH)
 PATH_GT_FILES = os.path.join(DATA_PATH, 'gt')  #, 'stratified')
 PATH_GL_FILES = os.path.join(DATA_PATH, 'gl')
 
-SRCFILE = 'ALL.chr20.snps.gt.vcf.gz'
+CHROM = '20'  # chromosome processed, as named in the VCF files
+chrom_name = 'chr{}'.format(CHROM)
+
+SRCFILE = 'ALL.{}.snps.gt.vcf.gz'.format(chrom_name)
 # PATH_OUT = ['ALL.chr20.pooled.snps.{}.chunk{}.vcf'.format(GTGL.lower(), CHK_SZ),
 #             'ALL.chr20.missing.snps.{}.chunk{}.vcf'.format(GTGL.lower(), CHK_SZ)]
-PATH_OUT = {'pooled': 'ALL.chr20.pooled.snps.{}.chunk{}.vcf'.format(GTGL.lower(), chk_name),
-            'missing': 'ALL.chr20.missing.snps.{}.chunk{}.vcf'.format(GTGL.lower(), chk_name)}
+PATH_OUT = {'pooled': 'ALL.{}.pooled.snps.{}.chunk{}.vcf'.format(chrom_name, GTGL.lower(), chk_name),
+            'missing': 'ALL.{}.missing.snps.{}.chunk{}.vcf'.format(chrom_name, GTGL.lower(), chk_name)}
 MSS = [False, True]
 POOL = [True, False]
-CHKFILE = 'ALL.chr20.snps.gt{}.vcf.gz'.format(chk_name)
+CHKFILE = 'ALL.{}.snps.gt{}.vcf.gz'.format(chrom_name, chk_name)
 
 # unknown_gl = [1/3, 1/3, 1/3]
 # unknown_gl = [0.2, 0.4, 0.4]
@@ -92,41 +95,46 @@ unknown_gl = 'adaptive'
 ### beagle.py
 BEAGLE_JAR = os.path.join(SCRIPTS_PATH, 'beagle.11Mar19.69c.jar')
 CFGT_JAR = os.path.join(SCRIPTS_PATH, 'conform-gt.jar')
-MAP_FILE = os.path.join(DATA_PATH, 'plink.GRCh37.map', 'plink.chr20.GRCh37.map')
+MAP_FILE = os.path.join(DATA_PATH, 'plink.GRCh37.map', 'plink.{}.GRCh37.map'.format(chrom_name))
+
+# samples ID of the whole population, of the study population and of the reference panel (1 ID per line)
+SAMPLES_ID = {'all': 'ALL.{}.snps.allID.txt'.format(chrom_name),
+              'imp': 'ALL.{}.snps.impID.txt'.format(chrom_name),
+              'ref': 'ALL.{}.snps.refID.txt'.format(chrom_name)}
 
 #TODO: rename beagle2.corr to imputed.gtdsgp
 #TODO: rename IMP to STU and REF to PAN
 
-RAW = {'vcf': 'ALL.chr20.snps.{}{}.vcf'.format('gt', chk_name),
-       'gz': 'ALL.chr20.snps.{}{}.vcf.gz'.format('gt', chk_name),
-       'ref': 'REF.chr20.snps.{}{}.vcf.gz'.format('gt', chk_name),
-       'imp': 'IMP.chr20.snps.{}{}.vcf.gz'.format('gt', chk_name),
-       'b1r': 'REF.chr20.beagle1{}'.format(chk_name),
-       'b1i': 'IMP.chr20.beagle1{}'.format(chk_name)}
-
-POOLED = {'vcf': 'ALL.chr20.pooled.snps.{}{}.vcf'.format(GTGL.lower(), chk_name),
-          'gz': 'ALL.chr20.pooled.snps.{}{}.vcf.gz'.format(GTGL.lower(), chk_name),
-          'imp': 'IMP.chr20.pooled.snps.{}{}.vcf.gz'.format(GTGL.lower(), chk_name),
-          'ref': 'REF.chr20.pooled.snps.{}{}.vcf.gz'.format(GTGL.lower(), chk_name),  # for MAF/AAF comparisons
-          'b1': 'IMP.chr20.pooled.beagle1{}'.format(chk_name),
-          'b2': 'IMP.chr20.pooled.beagle2.{}{}'.format(GTGL.lower(), chk_name),
-          'corr': 'IMP.chr20.pooled.beagle2.{}{}.corr'.format(GTGL.lower(), chk_name),
-          'cfgt': 'IMP.chr20.pooled.cfgt{}'.format(chk_name),
-          'gtonly': 'IMP.chr20.pooled.imputed.gt{}'.format(chk_name)}
-
-MISSING = {'vcf': 'ALL.chr20.missing.snps.{}{}.vcf'.format(GTGL.lower(), chk_name),
-           'gz': 'ALL.chr20.missing.snps.{}{}.vcf.gz'.format(GTGL.lower(), chk_name),
-           'imp': 'IMP.chr20.missing.snps.{}{}.vcf.gz'.format(GTGL.lower(), chk_name),
-           'b1': 'IMP.chr20.missing.beagle1{}'.format(chk_name),
-           'b2': 'IMP.chr20.missing.beagle2.{}{}'.format(GTGL.lower(), chk_name),
-           'corr': 'IMP.chr20.missing.beagle2.{}{}.corr'.format(GTGL.lower(), chk_name),
-           'cfgt': 'IMP.chr20.missing.cfgt{}'.format(chk_name),
-           'gtonly': 'IMP.chr20.missing.imputed.gt{}'.format(chk_name)}
+RAW = {'vcf': 'ALL.{}.snps.{}{}.vcf'.format(chrom_name, 'gt', chk_name),
+       'gz': 'ALL.{}.snps.{}{}.vcf.gz'.format(chrom_name, 'gt', chk_name),
+       'ref': 'REF.{}.snps.{}{}.vcf.gz'.format(chrom_name, 'gt', chk_name),
+       'imp': 'IMP.{}.snps.{}{}.vcf.gz'.format(chrom_name, 'gt', chk_name),
+       'b1r': 'REF.{}.beagle1{}'.format(chrom_name, chk_name),
+       'b1i': 'IMP.{}.beagle1{}'.format(chrom_name, chk_name)}
+
+POOLED = {'vcf': 'ALL.{}.pooled.snps.{}{}.vcf'.format(chrom_name, GTGL.lower(), chk_name),
+          'gz': 'ALL.{}.pooled.snps.{}{}.vcf.gz'.format(chrom_name, GTGL.lower(), chk_name),
+          'imp': 'IMP.{}.pooled.snps.{}{}.vcf.gz'.format(chrom_name, GTGL.lower(), chk_name),
+          'ref': 'REF.{}.pooled.snps.{}{}.vcf.gz'.format(chrom_name, GTGL.lower(), chk_name),  # for MAF/AAF comparisons
+          'b1': 'IMP.{}.pooled.beagle1{}'.format(chrom_name, chk_name),
+          'b2': 'IMP.{}.pooled.beagle2.{}{}'.format(chrom_name, GTGL.lower(), chk_name),
+          'corr': 'IMP.{}.pooled.beagle2.{}{}.corr'.format(chrom_name, GTGL.lower(), chk_name),
+          'cfgt': 'IMP.{}.pooled.cfgt{}'.format(chrom_name, chk_name),
+          'gtonly': 'IMP.{}.pooled.imputed.gt{}'.format(chrom_name, chk_name)}
+
+MISSING = {'vcf': 'ALL.{}.missing.snps.{}{}.vcf'.format(chrom_name, GTGL.lower(), chk_name),
+           'gz': 'ALL.{}.missing.snps.{}{}.vcf.gz'.format(chrom_name, GTGL.lower(), chk_name),
+           'imp': 'IMP.{}.missing.snps.{}{}.vcf.gz'.format(chrom_name, GTGL.lower(), chk_name),
+           'b1': 'IMP.{}.missing.beagle1{}'.format(chrom_name, chk_name),
+           'b2': 'IMP.{}.missing.beagle2.{}{}'.format(chrom_name, GTGL.lower(), chk_name),
+           'corr': 'IMP.{}.missing.beagle2.{}{}.corr'.format(chrom_name, GTGL.lower(), chk_name),
+           'cfgt': 'IMP.{}.missing.cfgt{}'.format(chrom_name, chk_name),
+           'gtonly': 'IMP.{}.missing.imputed.gt{}'.format(chrom_name, chk_name)}
 
 # To check: related individuals are removed from the file
 idv_nb = len(VCF(os.path.join(WD,
                               'gt',
-                              'ALL.chr20.snps.gt{}.vcf.gz'.format(chk_name))).samples)
+                              'ALL.{}.snps.gt{}.vcf.gz'.format(chrom_name, chk_name))).samples)
 pools_size = 16
 nb_pool, left = divmod(idv_nb, pools_size)
 nb_samples = nb_pool * pools_size
@@ -1,8 +1,12 @@
 import os
+import hashlib
+import tempfile
 import numpy as np
 import math
 from scipy.linalg import block_diag
+from scipy import sparse
 import itertools
+import functools
 import pandas as pd
 from typing import *
 
@@ -17,50 +21,69 @@ A variant is represented by a NumPy array with GT data for each sample.
 
 class Design(np.ndarray):
     """
-    Design matrix and pooling design
+    Design matrix and pooling design.
+    A block has shape (rows, columns) e.g. 4*4, 6*6, 4*6, with one pool per row and one pool per column.
     """
 
     def __new__(cls,
                 shape: np.ndarray = np.asarray([4, 4]),
                 id_len: int = 8,
-                pools_nb: int = 8,
-                pools_size: int = 4,
+                pools_nb: int = None,
+                pools_size: int = None,
                 blocks: int = 1) -> np.ndarray:
         """
         Define the basic structure for a pool i.e.
-        a squared matrix to fill with the variables IDs/GT/GL.
+        a matrix to fill with the variables IDs/GT/GL.
         :param shape: tuple, shape of the pool
         :param id_len: max number of char of the variables IDs
-        :param pools_nb: number of pools per block
-        :param pools_size: pool's size within a block
+        :param pools_nb: number of pools per block, rows + columns of the block if None
+        :param pools_size: row pools' size within a block, columns of the block if None
         :param blocks: number of repeated blocks
         :return: a matrix with dims 'shape', filled with str types
         """
-        cls.id_len = id_len
+        obj = np.empty_like(super(Design, cls).__new__(cls, tuple(np.asarray(shape).tolist())), dtype=int)
+        obj.id_len = id_len
         #id = 'U' + str(cls.id_len)
-        cls.pools_nb = pools_nb
-        cls.pools_size = pools_size
-        cls.blocks = blocks
-        return np.empty_like(super(Design, cls).__new__(cls, shape), dtype=int)
+        obj.pools_nb = sum(obj.shape) if pools_nb is None else pools_nb
+        obj.pools_size = obj.shape[1] if pools_size is None else pools_size
+        obj.blocks = blocks
+        return obj
+
+    @property
+    def pools_sizes(self) -> np.ndarray:
+        """Number of samples in every pool of a block, row pools before column pools"""
+        n_rows, n_cols = self.shape
+        return np.asarray([n_cols] * n_rows + [n_rows] * n_cols)
 
     @property
     def matrix(self) -> np.ndarray:
         """
         That function is not intended to be called explicitly.
+        The matrix is built once for a given shape and number of blocks, and is read-only.
         :param random: bool for dispatching idv randomly in the matrix?
         :return: design matrix. Numpy array.
         """
-        pools_size: int = self.pools_size
-        m: np.ndarray = np.zeros((self.pools_nb, self.size), dtype=int)
-        for i in range(int(self.pools_nb/self.ndim)):
-            j = i * pools_size
-            m[i, j:j+pools_size] = [1]*pools_size
-        for i in range(int(self.pools_nb/self.ndim), self.pools_nb):
-            j = i - pools_size
-            m[i, [j+k*pools_size for k in range(pools_size)]] = 1
-        b = itertools.repeat(m, self.blocks)
-        M = block_diag(*b)
-        return M
+        return get_design_matrix(self.shape, self.blocks)
+
+    @property
+    def sparse_matrix(self) -> sparse.csr_matrix:
+        """
+        Design matrix for all blocks as a sparse matrix, for dot-products based pooling.
+        Memory and computation scale linearly with the number of samples.
+        :return: design matrix. SciPy CSR matrix.
+        """
+        return get_design_sparse(self.shape, self.blocks)
+
+    def pool(self, scores: np.ndarray) -> np.ndarray:
+        """
+        Pools samples scores without any design matrix: samples are reshaped to blocks,
+        then rows and columns of every block are summed.
+        :param scores: samples scores with shape (..., N), samples sorted by blocks in row-major order
+        :return: pools scores with shape (..., blocks, pools_nb), row pools before column pools
+        """
+        scores = np.asarray(scores)
+        blocks = scores.reshape(scores.shape[:-1] + (-1,) + self.shape)
+        return np.concatenate([blocks.sum(axis=-1), blocks.sum(axis=-2)], axis=-1)
 
     def __array_finalize__(self, obj: object) -> None:
         """
@@ -71,40 +94,126 @@ class Design(np.ndarray):
         """
         if obj is None: return
         self.info = getattr(obj, 'info', None)
+        self.id_len = getattr(obj, 'id_len', 8)
+        self.pools_nb = getattr(obj, 'pools_nb', 8)
+        self.pools_size = getattr(obj, 'pools_size', 4)
+        self.blocks = getattr(obj, 'blocks', 1)
+
+    def __reduce__(self) -> tuple:
+        """Pickles the design attributes with the array e.g. for sending designs to worker processes"""
+        attributes = (self.info, self.id_len, self.pools_nb, self.pools_size, self.blocks)
+        reconstruct, arguments, state = super(Design, self).__reduce__()
+        return reconstruct, arguments, state + (attributes,)
+
+    def __setstate__(self, state: tuple) -> None:
+        self.info, self.id_len, self.pools_nb, self.pools_size, self.blocks = state[-1]
+        super(Design, self).__setstate__(state[:-1])
+
+
+@functools.lru_cache(maxsize=None)
+def get_design_matrix(shape: Tuple[int, int], blocks: int = 1) -> np.ndarray:
+    """
+    Design matrix of a NORB design, built once per block shape and number of blocks.
+    Row pools come first, then column pools. The array returned is read-only since it is shared.
+    :param shape: rows and columns of a block
+    :param blocks: number of repeated blocks
+    """
+    n_rows, n_cols = shape
+    samples: np.ndarray = np.arange(n_rows * n_cols).reshape(shape)
+    m: np.ndarray = np.zeros((n_rows + n_cols, n_rows * n_cols), dtype=int)
+    for i in range(n_rows):
+        m[i, samples[i, :]] = 1
+    for j in range(n_cols):
+        m[n_rows + j, samples[:, j]] = 1
+    b = itertools.repeat(m, blocks)
+    M = block_diag(*b)
+    M.flags.writeable = False
+    return M
+
+
+@functools.lru_cache(maxsize=None)
+def get_design_sparse(shape: Tuple[int, int], blocks: int = 1) -> sparse.csr_matrix:
+    """
+    Design matrix of a NORB design as a sparse matrix, built once per block shape and number of blocks.
+    """
+    return sparse.block_diag([get_design_matrix(shape)] * blocks, format='csr')
+
+
+def get_block_shape(design: np.ndarray) -> Tuple[int, int]:
+    """
+    Rows and columns of a block, from a Design object or from a design matrix.
+    In a design matrix, the first sample is at the cross section of the first row pool
+    and of the first column pool, and the first row pool spans all columns.
+    """
+    if isinstance(design, Design):
+        return design.shape
+    n_rows = int(np.flatnonzero(design[:, 0])[-1])
+    n_cols = int(np.count_nonzero(design[0, :]))
+    return n_rows, n_cols
 
 
 class Encoder(object):
     """
-    Simulate encoding step in pooling
+    Simulate encoding step in pooling.
+    The design is either a design matrix, or a Design object for pooling blockwise
+    without building the matrix (cost linear in the number of samples).
     """
     def __init__(self, design: object, format: str = 'gt'):
         self.ds = design
         assert format == 'gt'
         self.fmt = format
 
+    @property
+    def max_score(self) -> np.ndarray:
+        """Score of every pool where all samples are AA"""
+        if isinstance(self.ds, Design):
+            return self.ds.pools_sizes * 2  # 1 per pool in a block
+        return np.asarray(self.ds).sum(axis=-1) * 2  # diallelic markers assumed
+
     def encode(self, variant: np.ndarray):
         """
         :param variant: sum of alleles in GT format, binary array has shape (N,)
         where N is the number of samples
         """
-        scores: np.ndarray = variant  # np.apply_along_axis(sum, axis=-1, arr=variant)
-        pooled_gt = np.dot(self.ds,
-                           np.transpose(scores)).reshape((1, self.ds.shape[0], 1))
-        pooled_gt = np.broadcast_to(pooled_gt, (1, self.ds.shape[0], 2))
-        p = np.apply_along_axis(self.gt_converter, axis=-1, arr=pooled_gt)
+        scores: np.ndarray = np.asarray(variant).reshape((1, -1))
+        p = self.encode_batch(scores)
 
         return p  # list of gt for the 8 pools from design matrix
 
+    def encode_batch(self, variants: np.ndarray) -> np.ndarray:
+        """
+        Encodes several variants at once, without looping over pools or variants.
+        :param variants: sum of alleles in GT format, array has shape (V, N)
+        where V is the number of variants and N the number of samples
+        :return: pooled genotypes (unphased) with shape (V, P, 2) where P is the number of pools
+        """
+        scores: np.ndarray = np.atleast_2d(variants)
+        if isinstance(self.ds, Design):
+            pooled_scores = self.ds.pool(scores)  # (V, B, P / B)
+        else:
+            pooled_scores = np.dot(scores, np.transpose(self.ds))  # (V, P)
+        return self.gt_batch_converter(pooled_scores).reshape((scores.shape[0], -1, 2))
+
+    def gt_batch_converter(self, a: np.ndarray) -> np.ndarray:
+        """
+        Vectorized version of gt_converter applied to an array of pooled scores.
+        :param a: scores from matrix-matrix pooling, pools on the last axis
+        :return: pools' true genotypes, shape a.shape + (2,)
+        """
+        p = np.empty(a.shape + (2,), dtype=int)
+        p[..., 0] = (a != 0)  # RA or AA as soon as one allele is ALT in the pool
+        p[..., 1] = (a == self.max_score)  # AA * AA * AA * AA
+        return p
+
     def gt_converter(self, a: np.ndarray) -> np.ndarray:
         """
         Decodes pooled scores into individual GT.
         :param a: score from matrix-vector pooling
         :return: pool's true genotype with phase
         """
-        max_score = self.ds[0, :].sum() * 2  # diallelic markers assumed
         if np.all(a == 0):  # RR * RR * RR * RR
             gt = [0, 0]
-        elif np.all(a == max_score):  # AA * AA * AA * AA
+        elif np.all(a == self.max_score[0]):  # AA * AA * AA * AA
             gt = [1, 1]
         else:
             gt = [1, 0]
@@ -130,35 +239,8 @@ class DictBlockDecoder(object):
         :param pooled: sum of alleles of pooled true genotypes (unpohased)
         :return: individual samples genotypes (true genotype unphased)
         """
-        count_alt: np.ndarray = np.where(pooled >= 1, 1, 0)
-        count_ref: np.ndarray = np.where(pooled <= 1, 1, 0)
-        # 2 = value max of allele dosage with diploid diallelic markers
-
-        alt_row: int = np.sum(count_alt[4:])
-        alt_col: int = np.sum(count_alt[4:])
-        ref_row: int = np.sum(count_ref[:4])
-        ref_col: int = np.sum(count_ref[4:])
-
-        nb_alt: int = alt_row + alt_col
-        nb_ref: int = ref_row + ref_col
-
-        encoded = np.dot(pooled,
-                         self.ds).reshape(1, self.ds.shape[1], 1)
-        b = np.broadcast_to(encoded, (1, self.ds.shape[1], 2))
-        if nb_alt == 0:
-            decoded_gt = np.zeros_like(b)
-        elif nb_ref == 0:
-            aa = np.array([1, 1])
-            decoded_gt = np.tile(aa, self.ds.shape[1]).reshape((1, self.ds.shape[1], 2))
-        elif nb_alt == 2:
-            decoder: Callable = lambda x: [1, -1] if np.all(x == 2) else [0, 0]
-            # np.all() because of b.shape
-            decoded_gt = np.apply_along_axis(decoder, axis=-1, arr=b)
-        elif nb_ref == 2:  # symmetric case with ref allele in only 2 pools: individual is RR or RA
-            decoder: Callable = lambda x: [0, -1] if np.all(x == 2) else [1, 1]
-            decoded_gt = np.apply_along_axis(decoder, axis=-1, arr=b)
-        else:  # nb_alt > 2 and nb_alt < 8: # nb_alt = 2*n with n > 1
-            decoded_gt = np.apply_along_axis(self.multidecoder_gt, axis=-1, arr=b)
+        scores: np.ndarray = np.asarray(pooled).reshape((1, 1, self.ds.shape[0]))
+        decoded_gt = decode_batch_gt(scores, self.ds)
 
         return decoded_gt
 
@@ -166,54 +248,16 @@ class DictBlockDecoder(object):
         """
 
         """
-        scores: np.ndarray = pooled.flatten()  # np.apply_along_axis(sum, axis=-1, arr=pooled).flatten()
-        rowcolcounts = self.rowcolcounts(scores)
-        colcross = np.apply_along_axis(np.multiply, 1, self.ds.T, scores)  # (16, 8)
-        masks = np.ma.masked_where(self.ds.T, colcross)
+        shape = get_block_shape(self.ds)
+        scores: np.ndarray = np.asarray(pooled).flatten()
+        rowcolcounts = batch_rowcolcounts(scores, shape[0]).tolist()
         # Returns and sorts genotypes of pools cross section for an individual
-        crosses = np.sort(colcross[masks.mask].reshape((self.ds.shape[1], 2)))  # (self.ds.shape[1], 2) = (16, 2) and 2 is the weight of the design
+        crosses = np.sort(scores[get_crossing_pools(shape)], axis=-1).tolist()  # (samples, 2), 2 is the weight of the design
         unknown = [self.dict_gl[tuple([*rowcolcounts, *crs])] for crs in crosses]
         decoded_gp = np.asarray(unknown)
 
         return decoded_gp
 
-    @staticmethod
-    def rowcolcounts(a: np.ndarray) -> np.ndarray:
-        """
-        Count number of pooled RR|RA|AA genotypes over all rows and columns of a pooled matrix
-        :param a: score i.e. trinary-encoded true genotypes
-        :return: counts of genotypes for the rows and columns
-        """
-        # a should be scores
-        count_rr: np.ndarray = np.where(a == 0, 1, 0)
-        count_aa: np.ndarray = np.where(a == 2, 1, 0)
-        count_ra: np.ndarray = np.where(a == 1, 1, 0)
-
-        rowcolcounts: np.ndarray = np.zeros((3 * 2,), dtype=int)  # counts number of RR, RA, AA rows, same for columns
-        rowcolcounts[0] = np.sum(count_rr[:4])
-        rowcolcounts[3] = np.sum(count_rr[4:])
-        rowcolcounts[1] = np.sum(count_ra[:4])
-        rowcolcounts[4] = np.sum(count_ra[4:])
-        rowcolcounts[2] = np.sum(count_aa[:4])
-        rowcolcounts[5] = np.sum(count_aa[4:])
-
-        return rowcolcounts
-
-    @staticmethod
-    def multidecoder_gt(a: np.ndarray) -> np.ndarray:
-        """
-        Decodes pooled scores into individual GT.
-        :param a: score
-        :return: true genotype with phase
-        """
-        if np.all(a == 2):  # RA * RA
-            gt = [-1, -1]
-        elif np.all(a == 1) or np.all(a == 0):  # RA * RR or RR * RR
-            gt = [0, 0]
-        else:
-            gt = [1, 1]
-        return np.asarray(gt)
-
 
 class SingleBlockDecoder(object):
     """
@@ -228,6 +272,7 @@ class SingleBlockDecoder(object):
         self.fmt = format.upper()
         assert (self.fmt == 'GT' or self.fmt == 'GP'), 'Pooling to other formats than GT or GP not implemented'
         self.D, self.V = lookup_keys, lookup_vals
+        self.index, self.vals = get_lookup_gather(self.D, self.V, get_block_shape(self.ds))
 
     def decode_genotypes_gt(self, pooled: np.ndarray) -> np.ndarray:
         """
@@ -235,34 +280,8 @@ class SingleBlockDecoder(object):
         :param pooled: sum of alleles of pooled true genotypes (unpohased)
         :return: individual samples genotypes (true genotype unphased)
         """
-        count_alt: np.ndarray = np.where(pooled >= 1, 1, 0)
-        count_ref: np.ndarray = np.where(pooled <= 1, 1, 0)
-
-        alt_row: int = np.sum(count_alt[4:])
-        alt_col: int = np.sum(count_alt[4:])
-        ref_row: int = np.sum(count_ref[:4])
-        ref_col: int = np.sum(count_ref[4:])
-
-        nb_alt: int = alt_row + alt_col
-        nb_ref: int = ref_row + ref_col
-
-        encoded = np.dot(pooled,
-                         self.ds).reshape(1, self.ds.shape[1], 1)
-        b = np.broadcast_to(encoded, (1, self.ds.shape[1], 2))
-        if nb_alt == 0:
-            decoded_gt = np.zeros_like(b)
-        elif nb_ref == 0:
-            aa = np.array([1, 1])
-            decoded_gt = np.tile(aa, self.ds.shape[1]).reshape((1, self.ds.shape[1], 2))
-        elif nb_alt == 2:
-            decoder: Callable = lambda x: [1, -1] if np.all(x == 2) else [0, 0]
-            # np.all() because of b.shape
-            decoded_gt = np.apply_along_axis(decoder, axis=-1, arr=b)
-        elif nb_ref == 2:  # symmetric case with ref allele in only 2 pools: individual is RR or RA
-            decoder: Callable = lambda x: [0, -1] if np.all(x == 2) else [1, 1]
-            decoded_gt = np.apply_along_axis(decoder, axis=-1, arr=b)
-        else:  # nb_alt > 2 and nb_alt < 8: # nb_alt = 2*n with n > 1
-            decoded_gt = np.apply_along_axis(self.multidecoder_gt, axis=-1, arr=b)
+        scores: np.ndarray = np.asarray(pooled).reshape((1, 1, self.ds.shape[0]))
+        decoded_gt = decode_batch_gt(scores, self.ds)
 
         return decoded_gt
 
@@ -273,55 +292,26 @@ class SingleBlockDecoder(object):
         :param dict_gl: likelihoods values to set when encountering missing genotypes
         :return: individual samples genotypes (genotype likelihoods)
         """
-        scores: np.ndarray = pooled.flatten()  # np.apply_along_axis(sum, axis=-1, arr=pooled).flatten()
-        rowcolcounts = self.rowcolcounts(scores)
-        colcross = np.apply_along_axis(np.multiply, 1, self.ds.T, scores)  # (16, 8)
-        masks = np.ma.masked_where(self.ds.T, colcross)
-        # Returns and sorts genotypes of pools cross section for an individual
-        crosses = np.sort(colcross[masks.mask].reshape((self.ds.shape[1], 2)))  # (self.ds.shape[1], 2) = (16, 2) and 2 is the weight of the design
-        # this sorts colcross coordinates only (as sorted in the csv table too)
-        keys = np.asarray([[*rowcolcounts, *crs] for crs in crosses])
-        unknown = np.apply_along_axis(self.multidecoder_gp, axis=-1, arr=keys)
-        decoded_gl = np.asarray(unknown)
+        scores: np.ndarray = pooled.reshape((1, 1, self.ds.shape[0]))
+        decoded_gl = self.decode_batch_gp(scores)[0]
 
         return decoded_gl
 
-    @staticmethod
-    def rowcolcounts(a: np.ndarray) -> np.ndarray:
+    def decode_batch_gp(self, pooled: np.ndarray) -> np.ndarray:
         """
-        Count number of pooled RR|RA|AA genotypes over all rows and columns of a pooled matrix
-        :param a: score i.e. trinary-encoded true genotypes
-        :return: counts of genotypes for the rows and columns
+        Recomputes genotypes probabilities for many variants and blocks at once.
+        :param pooled: pooled scores with shape (variants, blocks, pools)
+        :return: individual samples genotypes probabilities with shape (variants, samples, 3)
         """
-        # a should be scores
-        count_rr: np.ndarray = np.where(a == 0, 1, 0)
-        count_aa: np.ndarray = np.where(a == 2, 1, 0)
-        count_ra: np.ndarray = np.where(a == 1, 1, 0)
+        return decode_batch_gp(pooled, self.ds, self.index, self.vals)
 
-        rowcolcounts: np.ndarray = np.zeros((3*2,), dtype=int)  # counts number of RR, RA, AA rows, same for columns
-        rowcolcounts[0] = np.sum(count_rr[:4])
-        rowcolcounts[3] = np.sum(count_rr[4:])
-        rowcolcounts[1] = np.sum(count_ra[:4])
-        rowcolcounts[4] = np.sum(count_ra[4:])
-        rowcolcounts[2] = np.sum(count_aa[:4])
-        rowcolcounts[5] = np.sum(count_aa[4:])
-
-        return rowcolcounts
-
-    @staticmethod
-    def multidecoder_gt(a: np.ndarray) -> np.ndarray:
+    def decode_batch_gt(self, pooled: np.ndarray) -> np.ndarray:
         """
-        Decodes pooled scores into individual GT.
-        :param a: score
-        :return: true genotype with phase
+        Recomputes true genotypes for many variants and blocks at once.
+        :param pooled: pooled scores with shape (variants, blocks, pools)
+        :return: individual samples genotypes (unphased) with shape (variants, samples, 2)
         """
-        if np.all(a == 2):  # RA * RA
-            gt = [-1, -1]
-        elif np.all(a == 1) or np.all(a == 0):  # RA * RR or RR * RR
-            gt = [0, 0]
-        else:
-            gt = [1, 1]
-        return np.asarray(gt)
+        return decode_batch_gt(pooled, self.ds)
 
     def multidecoder_gp(self, k: np.ndarray) -> np.ndarray:
         dkey = get_dummy_key(k)
@@ -339,17 +329,20 @@ class Decoder(object):
         """
 
     def __init__(self, design_matrix: np.ndarray, lookup_keys: np.ndarray, lookup_vals: np.ndarray, format: str = 'gt'):
-        self.dm = design_matrix  # matrix for all blocks
-        self.ds1 = Design()  # single block
+        self.dm = design_matrix  # matrix for all blocks, or Design object with the number of blocks
+        self.ds1 = Design(shape=get_block_shape(design_matrix))  # single block
         self.dm1 = self.ds1.matrix
         self.fmt = format.upper()
         assert (self.fmt == 'GT' or self.fmt == 'GP'), 'Pooling to other formats than GT or GP not implemented'
         self.D, self.V = lookup_keys, lookup_vals
+        self.index, self.vals = get_lookup_gather(self.D, self.V, self.ds1.shape)
         #TODO: if GP and None lookup -> decode into 0.33, 0.33, 0.33
 
 
     @property
     def n_blocks(self):
+        if isinstance(self.dm, Design):  # block-structured design without matrix
+            return self.dm.blocks
         return self.dm.shape[1] // self.dm1.shape[1]
 
     def decode_genotypes_gt(self, pooled: np.ndarray) -> np.ndarray:
@@ -358,101 +351,35 @@ class Decoder(object):
         :param pooled: sum of alleles of pooled true genotypes (unpohased)
         :return: individual samples genotypes (true genotype unphased)
         """
-        where_alt:  np.ndarray = np.where(pooled >= 1, 1, 0)
-        where_ref: np.ndarray = np.where(pooled <= 1, 1, 0)
-
-        count_alt: np.ndarray = where_alt.reshape((1, self.n_blocks, self.dm1.shape[0])).sum(axis=-1)  # 1 count per block
-        count_ref: np.ndarray = where_ref.reshape((1, self.n_blocks, self.dm1.shape[0])).sum(axis=-1)
+        scores: np.ndarray = np.asarray(pooled).reshape((1, self.n_blocks, self.dm1.shape[0]))
+        decoded_gt = self.decode_batch_gt(scores)[0]
 
-        nb_alt: np.ndarray = np.repeat(count_alt, self.dm1.shape[1])  # 1 count per sample
-        nb_ref: np.ndarray = np.repeat(count_ref, self.dm1.shape[1])
-
-        encoded = np.dot(pooled, self.dm).reshape(1, self.dm.shape[1], 1)
-        scores = np.full((5, self.dm.shape[1]), -1, dtype=int)
-        # 5 rows = 1 row for nb_alt, 1 row for nb_ref, 1 row for encoded, 2 rows for the decoded genotype
-        scores[0] = nb_alt
-        scores[1] = nb_ref
-        scores[2] = encoded.squeeze()
-        decoded_gt = np.apply_along_axis(self.multidecoder_gt, axis=0, arr=scores)[3:]
-
-        return decoded_gt.T
+        return decoded_gt
 
-    @staticmethod
-    def multidecoder_gt(a: np.ndarray) -> np.ndarray:
+    def decode_batch_gt(self, pooled: np.ndarray) -> np.ndarray:
         """
-        Decodes pooled scores into individual GT.
-        :param a: score as quintet
-        :return:
+        Recomputes true genotypes for many variants and blocks at once.
+        :param pooled: pooled scores with shape (variants, blocks, pools)
+        :return: individual samples genotypes (unphased) with shape (variants, samples, 2)
         """
-        if a[0] == 0:  # all RR
-            a[3] = 0
-            a[4] = 0
-        elif a[1] == 0:  # all AA
-            a[3] = 1
-            a[4] = 1
-        elif a[0] == 2:   # all RR but 1 AA or RA
-            if a[2] == 2:
-                a[3] = 1
-            else:
-                a[3] = 0
-                a[4] = 0
-        elif a[1] == 2:   # symmetric case: all AA but 1 RR or RA
-            if a[2] == 2:
-                a[3] = 0
-            else:
-                a[3] = 1
-                a[4] = 1
-        else:  # mix of RR, AA, RA/AR
-            if a[2] > 2:
-                a[3] = 1
-                a[4] = 1
-            elif a[2] < 2:
-                a[3] = 0
-                a[4] = 0
-        return a
+        return decode_batch_gt(pooled, self.dm1)
 
     def decode_genotypes_gp(self, pooled: np.ndarray) -> np.ndarray:
         """
 
         """
-        # Reshape for NumPy style np.apply_along_axis
-        scores: np.ndarray = pooled.reshape((self.n_blocks, self.dm1.shape[0]))
-        rowcolcounts = np.apply_along_axis(self.rowcolcounts, axis=-1, arr=scores)
-        # Gets scores of the pair of pools intersecting at each sample
-        colcross = np.apply_along_axis(np.multiply, 1, self.dm.T, pooled).squeeze()
-        # Masks non-zeros i.e. pair of pools scores
-        masks = np.ma.masked_where(self.dm.T, colcross)
-        # Returns and sorts genotypes of pools cross section for an individual
-        crosses = np.sort(colcross[masks.mask].reshape((self.dm.shape[1], 2)))  # 2 is the weight of the design
-        # this sorts colcross coordinates only (as sorted in the csv table too)
-        poolscounts = np.tile(rowcolcounts,
-                              self.dm1.shape[1]).reshape(self.dm.shape[1], rowcolcounts.shape[1])
-        keys = np.concatenate([poolscounts, crosses], axis=1)
-        decoded_gp = np.apply_along_axis(self.multidecoder_gp, axis=-1, arr=keys)
+        scores: np.ndarray = pooled.reshape((1, self.n_blocks, self.dm1.shape[0]))
+        decoded_gp = self.decode_batch_gp(scores)[0]
 
         return decoded_gp
 
-    @staticmethod
-    def rowcolcounts(a: np.ndarray) -> np.ndarray:
+    def decode_batch_gp(self, pooled: np.ndarray) -> np.ndarray:
         """
-        Count number of pooled RR|RA|AA genotypes over all rows and columns of a pooled matrix
-        :param a: score i.e. trinary-encoded true genotypes
-        :return: counts of genotypes for the rows and columns
+        Recomputes genotypes probabilities for many variants and blocks at once.
+        :param pooled: pooled scores with shape (variants, blocks, pools)
+        :return: individual samples genotypes probabilities with shape (variants, samples, 3)
         """
-        # a should be scores
-        count_rr: np.ndarray = np.where(a == 0, 1, 0)
-        count_aa: np.ndarray = np.where(a == 2, 1, 0)
-        count_ra: np.ndarray = np.where(a == 1, 1, 0)
-
-        rowcolcounts: np.ndarray = np.zeros((3*2,), dtype=int)  # counts number of RR, RA, AA rows, same for columns
-        rowcolcounts[0] = np.sum(count_rr[:4])
-        rowcolcounts[3] = np.sum(count_rr[4:])
-        rowcolcounts[1] = np.sum(count_ra[:4])
-        rowcolcounts[4] = np.sum(count_ra[4:])
-        rowcolcounts[2] = np.sum(count_aa[:4])
-        rowcolcounts[5] = np.sum(count_aa[4:])
-
-        return rowcolcounts
+        return decode_batch_gp(pooled, self.dm1, self.index, self.vals)
 
     def multidecoder_gp(self, k: np.ndarray) -> np.ndarray:
         dkey = get_dummy_key(k)
@@ -461,6 +388,106 @@ class Decoder(object):
         return gp
 
 
+class PatternDecoder(object):
+    """
+        Simulate decoding step in pooling for many variants and blocks at once.
+        A block has only 3^P distinct pooled patterns (P pools scoring 0, 1 or 2),
+        and the decoded genotypes of the block samples are a pure function of that pattern.
+        This version memoizes the decoded blocks in a table indexed by the base-3 id of the pattern:
+        decoding reduces to computing a pattern id per block and gathering from the table.
+        The table is precomputed if it has at most max_patterns rows, else it is filled lazily
+        with the patterns met while decoding and emptied whenever it exceeds max_patterns.
+        """
+
+    def __init__(self, design: np.ndarray, lookup_index: np.ndarray = None, lookup_vals: np.ndarray = None,
+                 max_patterns: int = 3 ** 8):
+        """
+        :param design: Design object or design matrix, only the block shape is used
+        :param lookup_index: dense index of the lookup table (see load_compiled_lookup), None for decoding GT only
+        :param lookup_vals: GP values of the lookup table, sentinel row last
+        :param max_patterns: maximum number of decoded blocks kept in the table
+        """
+        self.shape = get_block_shape(design)
+        self.ds1 = Design(shape=self.shape)  # single block
+        self.index, self.vals = lookup_index, lookup_vals
+        self.max_patterns = max_patterns
+        self.n_pools = self.ds1.pools_nb
+        self.powers = 3 ** np.arange(self.n_pools - 1, -1, -1, dtype=np.int64)  # first pool most significant
+        self.precomputed = 3 ** self.n_pools <= max_patterns
+        self.memo = {}  # lazily filled table: pattern id -> (lookup rows, GT)
+        if self.precomputed:
+            patterns = np.indices((3,) * self.n_pools).reshape((self.n_pools, -1)).T
+            self.rows_table, self.gt_table = self._decode_patterns(patterns)
+
+    def _decode_patterns(self, patterns: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Decodes blocks pooled with the given patterns
+        :param patterns: pooled scores with shape (n, pools)
+        :return: lookup rows with shape (n, samples) or None, GT with shape (n, samples, 2)
+        """
+        blocks = patterns[:, np.newaxis, :]
+        gt = decode_batch_gt(blocks, self.ds1).astype(np.int8)
+        rows = None
+        if self.index is not None:
+            rows = np.asarray(self.index)[batch_lookup_keys(blocks, self.ds1)].reshape((patterns.shape[0], -1))
+        return rows, gt
+
+    def pattern_ids(self, pooled: np.ndarray) -> np.ndarray:
+        """
+        Base-3 id of the pooled pattern of every block
+        :param pooled: pooled scores with shape (variants, blocks, pools)
+        :return: ids with shape (variants, blocks)
+        """
+        return np.asarray(pooled, dtype=np.int64).dot(self.powers)
+
+    def _gather(self, pooled: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Tables rows of the decoded blocks, and their ids in the tables"""
+        ids = self.pattern_ids(pooled)
+        if self.precomputed:
+            return ids, (self.rows_table, self.gt_table)
+        uniq, inverse = np.unique(ids, return_inverse=True)
+        missing = [i for i in uniq.tolist() if i not in self.memo]
+        if len(self.memo) + len(missing) > self.max_patterns:
+            self.memo.clear()
+            missing = uniq.tolist()
+        if len(missing) > 0:
+            digits = np.asarray(missing, dtype=np.int64)[:, np.newaxis] // self.powers % 3
+            rows, gt = self._decode_patterns(digits)
+            for n, i in enumerate(missing):
+                self.memo[i] = (None if rows is None else rows[n], gt[n])
+        entries = [self.memo[i] for i in uniq.tolist()]
+        rows = None if self.index is None else np.stack([e[0] for e in entries])
+        gt = np.stack([e[1] for e in entries])
+        return inverse.reshape(ids.shape), (rows, gt)
+
+    def decode_batch_rows(self, pooled: np.ndarray) -> np.ndarray:
+        """
+        Rows of the lookup table values decoded for every sample, -1 for keys missing from the table.
+        :param pooled: pooled scores with shape (variants, blocks, pools)
+        :return: lookup rows with shape (variants, samples)
+        """
+        assert self.index is not None, 'GP decoding needs a lookup table'
+        ids, (rows, gt) = self._gather(pooled)
+        return rows[ids].reshape((ids.shape[0], -1))
+
+    def decode_batch_gp(self, pooled: np.ndarray) -> np.ndarray:
+        """
+        Recomputes genotypes probabilities for many variants and blocks at once.
+        :param pooled: pooled scores with shape (variants, blocks, pools)
+        :return: individual samples genotypes probabilities with shape (variants, samples, 3)
+        """
+        return np.asarray(self.vals)[self.decode_batch_rows(pooled)]
+
+    def decode_batch_gt(self, pooled: np.ndarray) -> np.ndarray:
+        """
+        Recomputes true genotypes for many variants and blocks at once.
+        :param pooled: pooled scores with shape (variants, blocks, pools)
+        :return: individual samples genotypes (unphased, -1 for missing alleles) with shape (variants, samples, 2)
+        """
+        ids, (rows, gt) = self._gather(pooled)
+        return gt[ids].reshape((ids.shape[0], -1, 2))
+
+
 def load_lookup_table(path: str) -> pd.DataFrame:
     """
     Provides adaptive GL values as a DataFrame
@@ -497,13 +524,163 @@ def get_lookup_arrays(path: str) -> Tuple[Type[np.ndarray], Any]:
     return D, V
 
 
+@functools.lru_cache(maxsize=None)
+def get_key_radix(shape: Tuple[int, int] = (4, 4)) -> np.ndarray:
+    """
+    Number of possible values for each column of a lookup key:
+    counts of RR, RA, AA rows and columns, and genotypes of the 2 pools crossing at a sample
+    :param shape: rows and columns of a block
+    """
+    n_rows, n_cols = shape
+    radix = np.asarray([n_rows + 1] * 3 + [n_cols + 1] * 3 + [3, 3])  # 3 = genotypes RR, RA/AR, AA
+    radix.flags.writeable = False
+    return radix
+
+
+@functools.lru_cache(maxsize=None)
+def get_key_weights(shape: Tuple[int, int] = (4, 4)) -> np.ndarray:
+    """
+    Weights of the key columns for encoding a lookup key as a single mixed-radix integer
+    :param shape: rows and columns of a block
+    """
+    radix = get_key_radix(shape)
+    weights = np.ones_like(radix)
+    weights[:-1] = np.cumprod(radix[::-1])[::-1][1:]
+    weights.flags.writeable = False
+    return weights
+
+
+def get_lookup_index(lookup_keys: np.ndarray, shape: Tuple[int, int] = (4, 4)) -> np.ndarray:
+    """
+    Converts the categorical "dummy" array D to a dense index over all possible keys.
+    Keys are encoded as mixed-radix integers, the index gives the row of the key in D
+    or -1 if the key is not in the table.
+    """
+    radix = get_key_radix(shape)
+    offsets = np.cumsum(radix) - radix
+    keys = np.stack([lookup_keys[:, o:o + r].argmax(axis=-1) for o, r in zip(offsets, radix)], axis=-1)
+    index = np.full((np.prod(radix),), -1, dtype=int)
+    index[keys.dot(get_key_weights(shape))] = np.arange(keys.shape[0])
+    return index
+
+
+def get_lookup_gather(lookup_keys: np.ndarray, lookup_vals: np.ndarray,
+                      shape: Tuple[int, int] = (4, 4)) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Provides the dense index and the values to gather from for decoding GP.
+    :param lookup_keys: categorical "dummy" array D, or dense index from a compiled lookup table
+    :param lookup_vals: values array V, or values from a compiled lookup table (sentinel row included)
+    :param shape: rows and columns of a block
+    :return: dense index, values with the sentinel row for missing keys as last row
+    """
+    if lookup_keys.ndim == 1:  # already compiled, see load_compiled_lookup
+        return lookup_keys, lookup_vals
+    return get_lookup_index(lookup_keys, shape), with_sentinel(lookup_vals)
+
+
+def with_sentinel(lookup_vals: np.ndarray) -> np.ndarray:
+    """
+    Values of a lookup table with the sentinel row for missing keys appended as last row.
+    The sentinel is the zeros row, as in a compiled lookup table (see compile_lookup).
+    """
+    lookup_vals = np.asarray(lookup_vals, dtype=float)
+    return np.concatenate([lookup_vals, np.zeros((1, lookup_vals.shape[-1]))], axis=0)
+
+
+@functools.lru_cache(maxsize=None)
+def get_crossing_pools(shape: Tuple[int, int] = (4, 4)) -> np.ndarray:
+    """
+    Indices of the pair of pools intersecting at each sample of a block
+    :param shape: rows and columns of a block
+    :return: pools indices with shape (samples, 2), row pool first, 2 is the weight of the design
+    """
+    samples, pools = np.nonzero(np.transpose(get_design_matrix(shape)))
+    crossing = pools.reshape((-1, 2))
+    crossing.flags.writeable = False
+    return crossing
+
+
+def batch_rowcolcounts(pooled: np.ndarray, n_rows: int = None) -> np.ndarray:
+    """
+    Count number of pooled RR|RA|AA genotypes over all rows and columns of many blocks
+    :param pooled: pooled scores with shape (..., pools)
+    :param n_rows: number of row pools in a block, half of the pools if None
+    :return: counts of genotypes for the rows and columns with shape (..., 6)
+    """
+    n_rows = pooled.shape[-1] // 2 if n_rows is None else n_rows
+    gts = np.arange(3)  # RR, RA, AA
+    rowcounts = np.sum(pooled[..., :n_rows, np.newaxis] == gts, axis=-2)
+    colcounts = np.sum(pooled[..., n_rows:, np.newaxis] == gts, axis=-2)
+    return np.concatenate([rowcounts, colcounts], axis=-1)
+
+
+def batch_lookup_keys(pooled: np.ndarray, design1block: np.ndarray) -> np.ndarray:
+    """
+    Computes the lookup keys of all samples as mixed-radix integers
+    :param pooled: pooled scores with shape (..., pools)
+    :param design1block: design matrix for a single block, or Design object
+    :return: keys with shape (..., samples)
+    """
+    shape = get_block_shape(design1block)
+    weights = get_key_weights(shape)
+    blockkeys = batch_rowcolcounts(pooled, shape[0]).dot(weights[:-2])
+    # sorts genotypes of pools cross section for an individual (as sorted in the csv table too)
+    crosses = np.sort(pooled[..., get_crossing_pools(shape)], axis=-1)
+    return blockkeys[..., np.newaxis] + crosses.dot(weights[-2:])
+
+
+def decode_batch_gt(pooled: np.ndarray, design1block: np.ndarray) -> np.ndarray:
+    """
+    Decodes pooled scores of many variants and blocks into individual GT.
+    Rules applied blockwise, depending on the number of pools carrying ALT/REF alleles:
+    * all pools RR: every sample is RR
+    * all pools AA: every sample is AA
+    * ALT allele in only 2 pools: samples at their cross section are A?, other samples are RR
+    * REF allele in only 2 pools (symmetric case): samples at their cross section are R?, other samples are AA
+    * mix of RR, AA, RA/AR: a sample is decoded from the sum of its 2 pools scores,
+    AA if > 2, RR if < 2, else missing
+    :param pooled: pooled scores with shape (variants, blocks, pools)
+    :param design1block: design matrix for a single block, or Design object
+    :return: genotypes (unphased, -1 for missing alleles) with shape (variants, samples, 2)
+    """
+    pooled = np.asarray(pooled, dtype=int)
+    nb_alt: np.ndarray = np.sum(pooled >= 1, axis=-1, keepdims=True)  # 1 count per block
+    nb_ref: np.ndarray = np.sum(pooled <= 1, axis=-1, keepdims=True)
+    crossing = get_crossing_pools(get_block_shape(design1block))
+    encoded: np.ndarray = pooled[..., crossing].sum(axis=-1)  # 1 score per sample
+
+    cases = [nb_alt == 0, nb_ref == 0, nb_alt == 2, nb_ref == 2]
+    mixed = np.where(encoded > 2, 1, np.where(encoded < 2, 0, -1))
+    allele1 = np.select(cases, [0, 1, np.where(encoded == 2, 1, 0), np.where(encoded == 2, 0, 1)],
+                        default=mixed)
+    allele2 = np.select(cases, [0, 1, np.where(encoded == 2, -1, 0), np.where(encoded == 2, -1, 1)],
+                        default=mixed)
+    decoded_gt = np.stack([allele1, allele2], axis=-1)
+    return decoded_gt.reshape((pooled.shape[0], -1, 2))
+
+
+def decode_batch_gp(pooled: np.ndarray, design1block: np.ndarray,
+                    lookup_index: np.ndarray, lookup_vals: np.ndarray) -> np.ndarray:
+    """
+    Decodes pooled scores of many variants and blocks into genotypes probabilities.
+    Keys missing from the lookup table are decoded with the sentinel values in the last row.
+    :param pooled: pooled scores with shape (variants, blocks, pools)
+    :param design1block: design matrix for a single block, or Design object
+    :param lookup_index: dense index of the lookup table, -1 for missing keys
+    :param lookup_vals: GP values of the lookup table, sentinel row last
+    :return: genotypes probabilities with shape (variants, samples, 3)
+    """
+    pooled = np.asarray(pooled, dtype=int)
+    keys = batch_lookup_keys(pooled, design1block)
+    decoded_gp = lookup_vals[lookup_index[keys]]
+    return decoded_gp.reshape((pooled.shape[0], -1, lookup_vals.shape[1]))
+
+
 def get_dummy_key(k) -> np.ndarray:
     """
     Converts the key array to a categorical "dummy" array
     """
-    ds = Design()
-    rg = ds.pools_size + 1
-    strides = np.asarray([rg, rg, rg, rg, rg, rg, 3, 3])  # 3 = genotypes RR, RA/AR, AA
+    strides = get_key_radix()
     dumkey = np.zeros((strides.sum(),), dtype=int)
     idx = 0
     for i in range(len(k)):
@@ -512,26 +689,123 @@ def get_dummy_key(k) -> np.ndarray:
     return dumkey
 
 
-def load_lookup_dict(path: str, log10: bool = True) -> dict:
-    df = pd.read_csv(os.path.abspath(path),
-                     header=None,
-                     names=['rowsrr', 'rowsra', 'rowsaa', 'colsrr', 'colsra', 'colsaa',
-                            'n', 'm',
-                            'rr', 'ra', 'aa']
-                     )
+def get_lookup_hash(path: str) -> str:
+    """
+    Hash of the content of a lookup table file
+    """
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()[:16]
+
+
+def lookup_cache_dirs(path: str) -> List[str]:
+    """
+    Directories for the compiled lookup artifacts of a table, in order of preference:
+    the directory of the table, then a user cache directory, then the temporary directory
+    (e.g. if the table sits in a read-only shared data directory).
+    """
+    user_cache = os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+    return [os.path.dirname(os.path.abspath(path)),
+            os.path.join(user_cache, 'vcfpooling'),
+            os.path.join(tempfile.gettempdir(), 'vcfpooling')]
+
+
+def compile_lookup(path: str, cache_dir: str = None, shape: Tuple[int, int] = (4, 4)) -> Tuple[str, str]:
+    """
+    Compiles the adaptive GL table into a dense lookup artifact saved as .npy files:
+    * index: for every possible key encoded as a mixed-radix integer, row of its values,
+    or -1 (sentinel row) if the key is not in the table
+    * values: distinct values of the table in linear and log10 forms, shape (2, rows + 1, 3).
+    The last row is the sentinel for missing keys i.e. [0.0, 0.0, 0.0] (or -5.0 in log10 form).
+    The artifact is compiled again only if the content of the table changes.
+    :param path: path to the csv file with the adaptive GL values
+    :param cache_dir: directory for the compiled files. Per default, the directory of the table
+    or the first writable one of lookup_cache_dirs
+    :param shape: rows and columns of a block the table is computed for
+    :return: paths to the index and values files
+    """
+    path = os.path.abspath(path)
+    stem = '.'.join([os.path.splitext(os.path.basename(path))[0],
+                     'x'.join(str(n) for n in shape),
+                     get_lookup_hash(path)])
+    cache_dirs = lookup_cache_dirs(path) if cache_dir is None else [cache_dir]
+    for cdir in cache_dirs:  # compiled already
+        path_index = os.path.join(cdir, stem + '.index.npy')
+        path_vals = os.path.join(cdir, stem + '.values.npy')
+        if os.path.exists(path_index) and os.path.exists(path_vals):
+            return path_index, path_vals
+
+    T = np.loadtxt(path, delimiter=',', ndmin=2)
+    keys = T[:, :-3].astype(int)
+    vals, rows = np.unique(T[:, -3:], axis=0, return_inverse=True)
+    radix = get_key_radix(tuple(shape))
+    index = np.full((np.prod(radix),), -1, dtype=np.int32)
+    # raises ValueError if the table does not fit the block shape
+    index[np.ravel_multi_index(keys.T, radix)] = rows.reshape((-1,))
+    linear = with_sentinel(vals)
     log10func = lambda x: math.log10(x) if x > 1e-05 else -5.0
-    if log10:
-        df['rr'] = df['rr'].apply(log10func)
-        df['ra'] = df['ra'].apply(log10func)
-        df['aa'] = df['aa'].apply(log10func)
-    df2dict = dict(((int(rwrr), int(rwra), int(rwaa), int(clrr), int(clra), int(claa),
-                     int(n), int(m)),
-                    [rr, ra, aa]) for rwrr, rwra, rwaa, clrr, clra, claa,
-                                      n, m,
-                                      rr, ra, aa in df.itertuples(index=False, name=None))
+    log10 = np.asarray([[log10func(x) for x in row] for row in linear.tolist()])  # few distinct rows only
+    for n, cdir in enumerate(cache_dirs):
+        path_index = os.path.join(cdir, stem + '.index.npy')
+        path_vals = os.path.join(cdir, stem + '.values.npy')
+        try:
+            os.makedirs(cdir, exist_ok=True)
+            # write then rename: concurrent processes never load a partially written file
+            for f_npy, arr in [(path_vals, np.stack([linear, log10])), (path_index, index)]:
+                f_tmp = '{}.{}.tmp'.format(f_npy, os.getpid())
+                with open(f_tmp, 'wb') as f:
+                    np.save(f, arr)
+                os.replace(f_tmp, f_npy)
+            break
+        except OSError:  # e.g. read-only directory, try the next one
+            if n == len(cache_dirs) - 1:
+                raise
+    return path_index, path_vals
+
+
+def load_compiled_lookup(path: str, log10: bool = True, mmap: bool = True,
+                         cache_dir: str = None, shape: Tuple[int, int] = (4, 4)) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Provides the adaptive GL values as a dense index and a values array, compiling the table if needed.
+    With mmap, the arrays are memory-mapped read-only and can be shared by worker processes.
+    :param path: path to the csv file with the adaptive GL values
+    :param log10: values in log10 form if True, else linear
+    :param shape: rows and columns of a block the table is computed for
+    :return: dense index (-1 for missing keys), values with the sentinel row last
+    """
+    path_index, path_vals = compile_lookup(path, cache_dir=cache_dir, shape=shape)
+    mode = 'r' if mmap else None
+    index = np.load(path_index, mmap_mode=mode)
+    vals = np.load(path_vals, mmap_mode=mode)[int(log10)]
+    return index, vals
+
+
+def load_lookup_dict(path: str, log10: bool = True, shape: Tuple[int, int] = (4, 4)) -> dict:
+    """
+    Provides adaptive GL values as a dictionary with tuples of the key columns as keys
+    """
+    index, vals = load_compiled_lookup(path, log10=log10, shape=shape)
+    keys = np.flatnonzero(np.asarray(index) >= 0)
+    columns = np.stack(np.unravel_index(keys, get_key_radix(tuple(shape))), axis=-1)
+    df2dict = dict((tuple(k), vals[i].tolist()) for k, i in zip(columns.tolist(), index[keys]))
     return df2dict
 
 
+def get_dict_gather(lookup: dict, shape: Tuple[int, int] = (4, 4)) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Provides the dense index and the values to gather from for decoding GP with a lookup dictionary
+    (see load_lookup_dict). Keys missing from the dictionary point to the sentinel row (see with_sentinel).
+    :param lookup: values of the lookup table, with tuples of the key columns as keys
+    :param shape: rows and columns of a block the table is computed for
+    :return: dense index, values with the sentinel row for missing keys as last row
+    """
+    radix = get_key_radix(tuple(shape))
+    keys = np.asarray(list(lookup.keys()), dtype=int).reshape((len(lookup), len(radix)))
+    vals = np.asarray(list(lookup.values()), dtype=float)
+    index = np.full((np.prod(radix),), -1, dtype=np.int32)
+    index[np.ravel_multi_index(keys.T, radix)] = np.arange(len(keys))
+    return index, with_sentinel(vals)
+
+
 def blocks_decoder(nB, v, step, lookup_keys, lookup_vals, dec_fmt: str):
     """
     Decodes a single block from a NORB pooling design
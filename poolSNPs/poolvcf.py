@@ -1,4 +1,6 @@
 import sys, os
+import json
+import hashlib
 
 # force PYTHONPATH to look into the project directory for modules
 rootdir = os.path.dirname(os.path.dirname(os.getcwd()))
@@ -7,10 +9,18 @@ sys.path.insert(0, rootdir)
 from VCFPooling.poolSNPs.pooler import *
 from VCFPooling.poolSNPs import pybcf
 from VCFPooling.poolSNPs import utils
+from VCFPooling.poolSNPs.gtreader import GenotypeReader, GenotypeBatch, parse_line
+from VCFPooling.poolSNPs import gtstore
+from VCFPooling.poolSNPs import kernels
 
 import numpy as np
 import timeit
+import itertools
+import multiprocessing
+import threading
+import operator
 import pysam
+import pysam.bcftools
 
 """
 Classes for applying pooling simulation to a VCF file using Pysam
@@ -18,6 +28,15 @@ Classes for applying pooling simulation to a VCF file using Pysam
 
 np.random.seed(123)  # fix the shuffling order
 
+# unphased pooled GT calls indexed by 3 * (allele1 + 1) + (allele2 + 1), -1 for missing alleles
+GT_TOKENS = np.asarray(['/'.join('.' if a < 0 else str(a) for a in call)
+                        for call in itertools.product([-1, 0, 1], repeat=2)], dtype=object)
+
+
+def gt_calls(genotypes: np.ndarray) -> np.ndarray:
+    """Indices of decoded genotypes (..., 2) in GT_TOKENS"""
+    return 3 * (genotypes[..., 0] + 1) + (genotypes[..., 1] + 1)
+
 
 class ShuffleSplitVCF(object):
     """
@@ -48,31 +67,49 @@ class ShuffleSplitVCF(object):
         self.ref_prefix = 'REF'
         self.stu_prefix = 'IMP'
         self.wd = wd
+        self._samples = None
 
     @property
-    def samples(self):
+    def samples(self) -> List[str]:
         """Samples in the input VCF file"""
-        return pysam.VariantFile(self.filein).header.samples
+        if self._samples is None:
+            self._samples = list(pysam.VariantFile(self.filein).header.samples)
+        return self._samples
 
-    def _split_samples(self):
-        """Assign shuffled samples to reference/study by writing their ID in separate files"""
-        # Calculate the study population size
-        n_idv = len(self.samples)
-        block_size = self.design.shape[1]
-        n_blocks, left_over = divmod(n_idv, block_size)  # design constraint
-        n_samples = n_blocks * block_size
-        stu_blocks = utils.ppcm(n_samples, block_size) * self.stu_size // block_size  # number of blocks for the target
-        n_stu = int(stu_blocks * block_size)  # number of samples for the target set
+    def _split_samples(self) -> Tuple[List[str], List[str]]:
+        """
+        Assign shuffled samples to reference/study by writing their ID in separate files
+        :return: reference panel and study population samples, study samples in block order
+        """
         # Shuffle samples order
         samples = list(self.samples)
         np.random.seed(123)  # fix the shuffling order
         rng = np.random.default_rng()
         rng.shuffle(samples)
-        # Assign samples to populations
-        with open(self.ref_pan, 'w') as fpan:
+        return self._assign_samples(samples, self.ref_pan, self.stu_pop)
+
+    @property
+    def study_size(self) -> int:
+        """Number of samples in the study population"""
+        n_idv = len(self.samples)
+        block_size = self.design.shape[1]
+        n_blocks, left_over = divmod(n_idv, block_size)  # design constraint
+        n_samples = n_blocks * block_size
+        stu_blocks = utils.ppcm(n_samples, block_size) * self.stu_size // block_size  # number of blocks for the target
+        return int(stu_blocks * block_size)  # number of samples for the target set
+
+    def _assign_samples(self, samples: List[str], ref_pan: str, stu_pop: str) -> Tuple[List[str], List[str]]:
+        """
+        Assign shuffled samples to reference/study by writing their ID in separate files
+        :param samples: shuffled samples, the study population first
+        :return: reference panel and study population samples
+        """
+        n_stu = self.study_size
+        with open(ref_pan, 'w') as fpan:
             fpan.writelines([s + '\n' for s in samples[n_stu:]])
-        with open(self.stu_pop, 'w') as fstu:
+        with open(stu_pop, 'w') as fstu:
             fstu.writelines([s + '\n' for s in samples[:n_stu]])
+        return samples[n_stu:], samples[:n_stu]
 
     def split_file(self, base_name_out: str):
         """Write reference an target populations to files"""
@@ -88,15 +125,87 @@ class ShuffleSplitVCF(object):
                        wd=self.wd)
         pybcf.index(self.stu_prefix + '.' + base_name_out, wd=self.wd)
 
+    def split_file_inprocess(self, base_name_out: str, batch_size: int = 1000) -> None:
+        """
+        Write reference and target populations to bgzipped and indexed files in one pass over the input file.
+        Samples are written in the same order as with bcftools: study samples in block order (row-major).
+        INFO/AC and INFO/AN are recomputed for the samples of each population, as bcftools does.
+        :param base_name_out: name of the output files after the population prefix (.vcf.gz)
+        :param batch_size: number of variants written at once
+        """
+        populations = self._split_samples()
+        index_of = dict((s, i) for i, s in enumerate(self.samples))
+        columns = [[index_of[s] for s in pop] for pop in populations]
+        pickers = [operator.itemgetter(*cols) for cols in columns]
+        paths = [os.path.join(self.wd, prefix + '.' + base_name_out) for prefix in [self.ref_prefix, self.stu_prefix]]
+        header_lines = str(pysam.VariantFile(self.filein).header).rstrip('\n').split('\n')
+        headers = [header_samples(header_lines, pop) for pop in populations]
+        print('Splitting {} into {} and {}'.format(self.filein, *paths).ljust(80, '.'))
+        with pysam.BGZFile(paths[0], 'wb') as f_ref, pysam.BGZFile(paths[1], 'wb') as f_stu:
+            for f_out, header in zip([f_ref, f_stu], headers):
+                f_out.write(header.encode())
+            vcf_in = pysam.VariantFile(self.filein)
+            batch = []
+            for rec in itertools.chain(vcf_in.fetch() if vcf_in.index is not None else vcf_in, [None]):
+                if rec is not None:
+                    batch.append(str(rec))
+                if len(batch) == batch_size or (rec is None and len(batch) > 0):
+                    for f_out, cols, picker in zip([f_ref, f_stu], columns, pickers):
+                        f_out.write(''.join(subset_lines(batch, len(self.samples), cols, picker)).encode())
+                    batch = []
+        for path in paths:
+            pysam.tabix_index(path, preset='vcf', csi=True, force=True)
+
+
+def subset_lines(lines: List[str], n_samples: int, columns: List[int], picker: Callable) -> List[str]:
+    """
+    Subsets and reorders the samples of VCF data lines, and recomputes INFO/AC and INFO/AN for these samples.
+    :param lines: VCF data lines
+    :param n_samples: number of samples in the lines
+    :param columns: indices of the samples to keep, in output order
+    :param picker: getter of the samples to keep, e.g. operator.itemgetter(*columns)
+    :return: subset VCF data lines
+    """
+    out = []
+    for line in lines:
+        site, gt, missing = parse_line(line, n_samples)
+        cols = line.rstrip('\n').split('\t')
+        alleles = gt[columns]
+        n_alts = site[4].count(',') + 1
+        info = update_counts(cols[7], [(alleles == k).sum() for k in range(1, n_alts + 1)], (alleles >= 0).sum())
+        out.append('\t'.join(cols[:7] + [info, cols[8], *picker(cols[9:])]) + '\n')
+    return out
+
+
+def update_counts(info: str, ac: Iterable[int], an: int) -> str:
+    """INFO column with the values of AC and AN replaced, other fields unchanged"""
+    fields = info.split(';')
+    for i, field in enumerate(fields):
+        if field.startswith('AC='):
+            fields[i] = 'AC=' + ','.join(str(int(c)) for c in ac)
+        elif field.startswith('AN='):
+            fields[i] = 'AN={}'.format(int(an))
+    return ';'.join(fields)
+
+
+def header_samples(header_lines: List[str], samples: List[str]) -> str:
+    """
+    VCF header text with other samples
+    :param header_lines: lines of a VCF header, #CHROM line last
+    :param samples: samples of the new header
+    """
+    return '\n'.join(header_lines[:-1] + ['\t'.join(header_lines[-1].split('\t')[:9] + list(samples))]) + '\n'
+
 
 class VariantRecordPooler(object):
     """
     Applies pooling simulation to samples' genotypes at a variant.
     """
     def __init__(self, design_matrix: np.ndarray, var: pysam.VariantRecord,
-                 dict_lookup: dict, format_to: str, wd: str = os.getcwd()):
+                 dict_lookup: dict, format_to: str, wd: str = os.getcwd(), genotypes: np.ndarray = None):
         """
         The NonOverlapping Repeated Block pooling design applied is provided with the design matrix.
+        :param genotypes: GT of the variant with shape (samples, 2) if already read (see gtreader.GenotypeReader)
         """
         self.dm = design_matrix
         self.var = var.copy()
@@ -104,6 +213,9 @@ class VariantRecordPooler(object):
         self.lookup = dict_lookup
         self.fmt_to = format_to.upper()  # decode into GT or GP
         self.wd = wd
+        if genotypes is None:
+            genotypes = np.asarray([v['GT'] for v in self.var.samples.values()])
+        self._genotypes = genotypes
 
     @property
     def samples(self):
@@ -113,18 +225,17 @@ class VariantRecordPooler(object):
     @property
     def genotypes(self):
         """True genotypes GT only"""
-        return np.asarray([v['GT'] for v in self.var.samples.values()])
+        return self._genotypes
 
     @property
     def n_blocks(self) -> int:
         """Number of pooling blocks from the sampples"""
-        assert len(self.samples) % self.dm.shape[1] == 0  # check all samples fit in some block
-        return len(self.samples) // self.dm.shape[1]
+        assert self.genotypes.shape[0] % self.dm.shape[1] == 0  # check all samples fit in some block
+        return self.genotypes.shape[0] // self.dm.shape[1]
 
     def _encode(self) -> np.ndarray:
         dse = Design(blocks=self.n_blocks)
-        dme = dse.matrix
-        enc = Encoder(dme)
+        enc = Encoder(dse)
         return enc.encode(self.genotypes.sum(axis=-1))
 
     def _decode(self) -> np.ndarray:
@@ -138,6 +249,12 @@ class VariantRecordPooler(object):
         Outputs a string representation of a pooled variant
         since pysam.VariantRecord objects are not writable
         """
+        if self.fmt_to == 'GT':
+            # all unphased pooled genotypes, half-missing calls included, written at once from the tokens table
+            pooled = self._encode().sum(axis=-1).reshape((1, self.n_blocks, -1))
+            _genotypes = decode_batch_gt(pooled, Design(shape=get_block_shape(self.dm)))[0]
+            fixed = str(self.var).split('\t', 8)[:8]
+            return '\t'.join([*fixed, 'GT', *GT_TOKENS[gt_calls(_genotypes)].tolist()]) + '\n'
         _genotypes = self._decode().reshape((self.genotypes.shape[0], 3))  # 3 --> GP(RR, RA, AA)
         if self.fmt_to == 'GP':
             # GP must be written as GL (literaly) for compatibility with Beagle
@@ -157,34 +274,113 @@ class VariantRecordPooler(object):
         # self.var.format = 'GP'
         # AttributeError: attribute 'format' of 'pysam.libcbcf.VariantRecord' objects is not writable
         for _i, v in enumerate(self.var.samples.values()):
-            if self.fmt_to == 'GP':
-                str_var = str_var + '\t' + ','.join(_genotypes[_i].astype(str))
-                # self.var.format.clear() # Process finished with exit code 139 (interrupted by signal 11: SIGSEGV)
-            elif self.fmt_to == 'GT':
-                try:
-                    v[self.fmt_to] = tuple(_genotypes[_i])  # in-place modification of the genotype values
-                except ValueError:  # pysam does not accept -1 but set None for missing alleles
-                    if _genotypes[_i].sum() == 0:  # case [1, -1]
-                        v[self.fmt_to] = (1, None)
-                    elif _genotypes[_i].sum() == -1:  # case [0, -1]
-                        v[self.fmt_to] = (0, None)
-                    else:  # case [-1, -1]
-                        v[self.fmt_to] = (None, None)
-                finally:
-                    v.phased = False  # set phase to unphased after pooling
-                str_var = self.var.__str__()
-        if self.fmt_to == 'GP':
-            str_var = str_var + '\n'
+            str_var = str_var + '\t' + ','.join(_genotypes[_i].astype(str))
+            # self.var.format.clear() # Process finished with exit code 139 (interrupted by signal 11: SIGSEGV)
+        str_var = str_var + '\n'
         return str_var
 
 
+class PoolingContext(object):
+    """
+    Pooling simulation setup shared by all the variants of a file.
+    The design, encoder, decoder and lookup table are built once, and the samples layout is validated once,
+    such that batches of records are pooled without rebuilding or copying anything per record.
+    With the numba backend (see kernels), pooling and decoding run fused in the compiled kernels.
+    """
+    def __init__(self, design_matrix: np.ndarray, n_samples: int, lookup: Union[dict, Tuple[np.ndarray, np.ndarray]],
+                 format_to: str, backend: str = None):
+        """
+        :param design_matrix: pooling design for 1 block, as a design matrix or a pooler.Design object
+        :param n_samples: number of samples in the file, in block order
+        :param lookup: lookup dictionary (see pooler.load_lookup_dict),
+        or dense index and values (see pooler.load_compiled_lookup)
+        :param format_to: 'GT' or 'GP'
+        :param backend: 'numpy' or 'numba', backend set in kernels at pooling time if None
+        """
+        self.backend = backend
+        self.fmt_to = format_to.upper()
+        assert (self.fmt_to == 'GT' or self.fmt_to == 'GP'), 'Pooling to other formats than GT or GP not implemented'
+        self.shape = get_block_shape(design_matrix)
+        block_size = self.shape[0] * self.shape[1]
+        assert n_samples % block_size == 0, \
+            '{} samples do not fit in blocks of size {}'.format(n_samples, block_size)
+        self.n_samples = n_samples
+        self.n_blocks = n_samples // block_size
+        self.design = Design(shape=self.shape, blocks=self.n_blocks)
+        self.encoder = Encoder(self.design)
+        # keys missing from a dictionary are errors, missing keys of a compiled table decode to its sentinel row
+        self.strict = isinstance(lookup, dict)
+        self.index, self.vals = get_dict_gather(lookup, self.shape) if self.strict else lookup
+        self.decoder = PatternDecoder(self.design, self.index, self.vals)
+        # GP values are rows of the lookup table: every row is formatted only once
+        self.gp_tokens = np.asarray([','.join(row) for row in np.asarray(self.vals).astype(str)], dtype=object)
+
+    def pool(self, genotypes: np.ndarray) -> np.ndarray:
+        """
+        :param genotypes: true genotypes with shape (variants, samples, 2)
+        :return: pooled scores with shape (variants, blocks, pools)
+        """
+        pooled = self.encoder.encode_batch(genotypes.sum(axis=-1)).sum(axis=-1)
+        return pooled.reshape((genotypes.shape[0], self.n_blocks, self.design.pools_nb))
+
+    def decode_gt(self, pooled: np.ndarray) -> np.ndarray:
+        """Unphased genotypes with shape (variants, samples, 2), -1 for missing alleles"""
+        return self.decoder.decode_batch_gt(pooled)
+
+    @property
+    def format_key(self) -> str:
+        """FORMAT column of the pooled variants. GP must be written as GL (literaly) for compatibility with Beagle"""
+        return 'GL' if self.fmt_to == 'GP' else 'GT'
+
+    def tokens(self, pooled: np.ndarray) -> np.ndarray:
+        """
+        :param pooled: pooled scores with shape (variants, blocks, pools)
+        :return: formatted decoded genotypes with shape (variants, samples)
+        """
+        if self.fmt_to == 'GP':
+            rows = self.decoder.decode_batch_rows(pooled)
+            assert not (self.strict and (rows < 0).any()), 'Pooling pattern missing from the lookup table'
+            return self.gp_tokens[rows]
+        return GT_TOKENS[gt_calls(self.decode_gt(pooled))]
+
+    def pool_tokens(self, genotypes: np.ndarray) -> np.ndarray:
+        """
+        Pools and decodes true genotypes with the backend of the context.
+        :param genotypes: true genotypes with shape (variants, samples, 2)
+        :return: formatted decoded genotypes with shape (variants, samples)
+        """
+        backend = kernels.resolve_backend(self.backend)
+        if backend != 'numba':
+            return self.tokens(self.pool(genotypes))
+        dosages = genotypes.sum(axis=-1)
+        if self.fmt_to == 'GP':
+            rows = kernels.pool_decode_rows(dosages, self.shape, self.index, backend=backend)
+            assert not (self.strict and (rows < 0).any()), 'Pooling pattern missing from the lookup table'
+            return self.gp_tokens[rows]
+        return GT_TOKENS[gt_calls(kernels.pool_decode_gt(dosages, self.shape, backend=backend))]
+
+    def new_vars(self, batch: GenotypeBatch) -> Iterator[str]:
+        """
+        Pools the variants of a batch read with gtreader.GenotypeReader
+        :return: string representations of the pooled variants
+        """
+        assert not batch.missing.any(), 'Pooling missing genotypes not implemented'
+        assert batch.gt.shape[1] == self.n_samples
+        for fixed, tokens in zip(batch.sites['fixed'], self.pool_tokens(batch.gt)):
+            yield '\t'.join([fixed, self.format_key, *tokens.tolist()]) + '\n'
+
+
 class VariantFilePooler(object):
     """Writes a new VariantFile. Add GL format to the header if necessary"""
     def __init__(self, design_matrix: np.ndarray, vcf_in: str, vcf_out: str,
-                 dict_lookup: dict, format_to: str, wd: str = os.getcwd()):
+                 dict_lookup: dict, format_to: str, wd: str = os.getcwd(), batch_size: int = 1000,
+                 out_format: str = 'vcf', store: bool = False):
         """
         The NonOverlapping Repeated Block pooling design applied is provided with the design matrix.
         Pooling from only GT genotype format to only GT or GP format implemented.
+        :param batch_size: number of variants which genotypes are read at once
+        :param out_format: 'vcf' for bgzipped VCF (<vcf_out>.gz) or 'bcf' for BCF (<vcf_out>.bcf, .vcf extension removed)
+        :param store: read the genotypes from the store of the input file (see gtstore), converted if needed
         """
         self.design = design_matrix
         self.vcf_in = pysam.VariantFile(vcf_in)
@@ -194,54 +390,296 @@ class VariantFilePooler(object):
         self.fmt_to = format_to.upper()
         assert (self.fmt_to == 'GT' or self.fmt_to == 'GP'), 'Pooling to other formats than GT or GP not implemented'
         self.wd = wd
+        self.batch_size = batch_size
+        self.out_format = out_format.upper()
+        assert (self.out_format == 'VCF' or self.out_format == 'BCF'), 'Writing other formats than VCF or BCF not implemented'
+        self.store = store
         self.header = None
         self.data = None
         self.n_variants = 0
+        self.context = PoolingContext(self.design, len(self.vcf_in.header.samples), self.lookup, self.fmt_to)
+
+    @property
+    def path_compressed(self) -> str:
+        """Path to the pooled output file"""
+        if self.out_format == 'BCF':
+            return (self.path_out[:-4] if self.path_out.endswith('.vcf') else self.path_out) + '.bcf'
+        return self.path_out + '.gz'
+
+    def path_contig(self, contig: str) -> str:
+        """Path to the pooled output file of a contig e.g. <vcf_out>.<contig>.vcf.gz"""
+        path = self.path_compressed
+        for extension in ['.vcf.gz', '.bcf', '.gz']:
+            if path.endswith(extension):
+                return '{}.{}{}'.format(path[:-len(extension)], contig, extension)
 
     def _new_header(self):
         """Modifies VCF header in-place if necessary (new GP format from pooling)"""
-        # GP header record
-        # ##FORMAT=<ID=GP,Number=G,Type=Float,Description="Estimated Genotype Probability">
-        if self.fmt_to == 'GP':
-            for hrec in list(self.vcf_in.header.records):
-                drec = dict(hrec)
-                if drec != {} and drec['ID'] == 'GT':
-                    hrec.remove()
-            self.vcf_in.header.add_line(
-                '##FORMAT=<ID=GL,Number=G,Type=Float,Description="Estimated Genotype Probability">')
-            # GP must be written as GL (literaly) for compatibility with Beagle
+        pooled_header(self.vcf_in.header, self.fmt_to)
         self.header = iter([hrec for hrec in self.vcf_in.header.records])
 
-    def _new_data(self):
-        """Simulates NORB pooling on the variants in the input file"""
+    def _pool_variants(self) -> Iterator[str]:
+        """Pools the variants in the input file one at a time"""
         print('Pooling data in {}'.format(self.path_in).ljust(80, '.'))
-        pvar = []
         tm = timeit.default_timer()
-        for n, var in enumerate(self.vcf_in.fetch()):
-            prec = VariantRecordPooler(self.design, var, self.lookup, self.fmt_to)
-            pvar.append(prec.new_var())
-            self.n_variants += 1
-            if n % 1000 == 0:
-                print('{} variants processed in {:06.2f} sec'.format(n + 1, timeit.default_timer() - tm).ljust(80, '.'))
-        self.data = iter(pvar)
-
-    def write(self) -> None:
-        """Writes pooling simulation result into an output file"""
+        if self.store:
+            batches = gtstore.open_store(self.path_in, formats=['GT']).batches(self.batch_size)
+        else:
+            batches = GenotypeReader(self.path_in, self.batch_size)
+        for batch in batches:
+            yield from self.context.new_vars(batch)
+            self.n_variants += len(batch)
+            print('{} variants processed in {:06.2f} sec'.format(self.n_variants,
+                                                                 timeit.default_timer() - tm).ljust(80, '.'))
+
+    def _new_data(self):
+        """Simulates NORB pooling on the variants in the input file. Variants are pooled lazily while written."""
+        self.data = self._pool_variants()
+
+    def write(self, buffer_size: int = 2 ** 20) -> None:
+        """
+        Writes pooling simulation result into a bgzipped and indexed output file.
+        Pooled variants are streamed to the compressed file as they are produced,
+        such that the memory used does not depend on the number of variants.
+        :param buffer_size: size in bytes of the pooled data buffered before being compressed
+        """
         # load header and data to write
         self._new_header()
         self._new_data()
-        # write as text-like file
-        print('\r\nWriting metadata in {}'.format(self.path_out).ljust(80, '.'))
-        vcf_out = pysam.VariantFile(self.path_out, 'w', header=self.vcf_in.header)
-        vcf_out.close()
-        print('\r\nWriting data in {}'.format(self.path_out).ljust(80, '.'))
-        with open(self.path_out, 'a') as f_out:
-            f_out.writelines(self.data)
-        print('Writing data in {}: Done'.format(self.path_out).rjust(80, '.'))
-        # compress and index the VCF file
-        pybcf.bgzip(self.path_out, self.path_out + '.gz', wd=self.wd)
-        pybcf.index(self.path_out + '.gz', wd=self.wd)
-        os.remove(self.path_out)
+        path_gz = self.path_compressed
+        print('\r\nWriting data in {}'.format(path_gz).ljust(80, '.'))
+        lines = itertools.chain([str(self.vcf_in.header)], self.data)
+        if self.out_format == 'BCF':
+            write_bcf(path_gz, lines)
+        else:
+            write_bgzf(path_gz, lines, buffer_size)
+        print('Writing data in {}: Done'.format(path_gz).rjust(80, '.'))
+        # index the compressed file
+        index_compressed(path_gz)
+
+    def write_parallel(self, processes: int = None, regions_per_process: int = 4, checkpoint_dir: str = None,
+                       split_contigs: bool = False) -> None:
+        """
+        Writes pooling simulation result into a bgzipped and indexed output file.
+        The input file is split into genomic regions with its index, and each region is pooled in a worker process.
+        The compressed regions are concatenated in coordinate order.
+        With a checkpoint directory, the run is resumable: every pooled region is committed to a part file
+        in that directory and recorded with its checksum in a manifest. Started again with the same directory,
+        the run pools only the regions which are not committed yet.
+        :param processes: number of worker processes, all CPUs per default
+        :param regions_per_process: number of regions per process, for balancing the work between processes
+        :param checkpoint_dir: directory for the parts and the manifest of a resumable run
+        :param split_contigs: write one output file per contig (see path_contig) instead of one file
+        """
+        processes = os.cpu_count() if processes is None else processes
+        self._new_header()
+        header = str(self.vcf_in.header)
+        path_gz = self.path_compressed
+        extension = '.bcf' if self.out_format == 'BCF' else '.vcf.gz'
+        settings = self._run_settings()
+        if checkpoint_dir is not None:
+            os.makedirs(checkpoint_dir, exist_ok=True)
+            for f_tmp in [f for f in os.listdir(checkpoint_dir) if f.endswith('.tmp')]:  # parts of killed workers
+                os.remove(os.path.join(checkpoint_dir, f_tmp))
+        manifest = None if checkpoint_dir is None else load_manifest(checkpoint_dir, settings)
+        if manifest is None:
+            regions = get_regions(self.path_in, processes * regions_per_process)
+            manifest = {'settings': settings, 'regions': regions, 'parts': {}}
+        regions = [tuple(reg) for reg in manifest['regions']]
+        if checkpoint_dir is None:
+            parts = ['{}.part{:05d}{}'.format(path_gz, i, extension) for i in range(len(regions))]
+        else:
+            parts = [os.path.join(checkpoint_dir, 'part{:05d}{}'.format(i, extension)) for i in range(len(regions))]
+            save_manifest(checkpoint_dir, manifest)
+        committed = [i for i, part in enumerate(parts)
+                     if os.path.basename(part) in manifest['parts']
+                     and os.path.exists(part)
+                     and manifest['parts'][os.path.basename(part)]['sha256'] == file_checksum(part)]
+        for i in committed:
+            self.n_variants += manifest['parts'][os.path.basename(parts[i])]['n_variants']
+        # BCF parts start with their own header, VCF parts are data only
+        tasks = [(self.path_in, reg, self.context, part, header if self.out_format == 'BCF' else None)
+                 for i, (reg, part) in enumerate(zip(regions, parts)) if i not in committed]
+        print('Pooling data in {} with {} processes: {}/{} regions already pooled'.format(
+            self.path_in, processes, len(committed), len(regions)).ljust(80, '.'))
+        tm = timeit.default_timer()
+        with multiprocessing.Pool(processes) as pool:
+            for n, (part, n_var, checksum) in enumerate(pool.imap_unordered(_pool_region, tasks)):
+                self.n_variants += n_var
+                if checkpoint_dir is not None:
+                    manifest['parts'][os.path.basename(part)] = {'n_variants': n_var, 'sha256': checksum}
+                    save_manifest(checkpoint_dir, manifest)
+                print('{} ({}/{}): {} variants processed in {:06.2f} sec'.format(
+                    os.path.basename(part), n + 1, len(tasks), n_var, timeit.default_timer() - tm).ljust(80, '.'))
+        if split_contigs:
+            contigs = list(dict.fromkeys(reg[0] for reg in regions))  # in file order
+            outputs = [(self.path_contig(c), [part for part, reg in zip(parts, regions) if reg[0] == c])
+                       for c in contigs]
+        else:
+            outputs = [(path_gz, parts)]
+        path_header = '{}.header{}'.format(path_gz, extension)
+        if self.out_format == 'VCF':
+            write_bgzf(path_header, [header])
+        for path_output, output_parts in outputs:
+            if self.out_format == 'BCF':
+                pysam.bcftools.concat('--naive', '-o', path_output, *output_parts, catch_stdout=False)
+            else:
+                concatenate_bgzf([path_header] + output_parts, path_output)
+            index_compressed(path_output)
+            print('Writing data in {}: Done'.format(path_output).rjust(80, '.'))
+        if self.out_format == 'VCF':
+            os.remove(path_header)
+        for part in parts:
+            os.remove(part)
+        if checkpoint_dir is not None:
+            os.remove(os.path.join(checkpoint_dir, MANIFEST))
+
+    def _run_settings(self) -> dict:
+        """Input and pooling settings a checkpointed run can be resumed with"""
+        lookup_hash = hashlib.sha256(np.ascontiguousarray(self.context.index).tobytes())
+        lookup_hash.update(np.ascontiguousarray(self.context.vals).tobytes())
+        return {'input': os.path.abspath(self.path_in),
+                'input_size': os.path.getsize(self.path_in),
+                'input_mtime': os.path.getmtime(self.path_in),
+                'shape': list(self.context.shape),
+                'lookup': lookup_hash.hexdigest(),
+                'format_to': self.fmt_to,
+                'out_format': self.out_format}
+
+
+def pooled_header(header: pysam.VariantHeader, format_to: str) -> None:
+    """Modifies VCF header in-place if necessary (new GP format from pooling)"""
+    # GP header record
+    # ##FORMAT=<ID=GP,Number=G,Type=Float,Description="Estimated Genotype Probability">
+    if format_to.upper() == 'GP':
+        for hrec in list(header.records):
+            drec = dict(hrec)
+            if drec != {} and drec['ID'] == 'GT':
+                hrec.remove()
+        header.add_line(
+            '##FORMAT=<ID=GL,Number=G,Type=Float,Description="Estimated Genotype Probability">')
+        # GP must be written as GL (literaly) for compatibility with Beagle
+
+
+class ReplicatePooler(object):
+    """
+    Monte Carlo replicates of the pooling simulation, for measuring the sensitivity of the results
+    to the random assignment of the samples to the blocks.
+    For every replicate, the samples of the input file are shuffled and split into reference panel
+    and study population as with ShuffleSplitVCF, and the study population is pooled.
+    The input file is read once: the genotypes of a batch of variants are permuted for all the replicates,
+    and the replicates are pooled and decoded together as one batch.
+    """
+    def __init__(self, design_matrix: np.ndarray, vcf_in: str, dict_lookup: dict, format_to: str,
+                 n_replicates: int, seed: int = 123, stu_size: float = 0.1, wd: str = os.getcwd(),
+                 batch_size: int = 1000):
+        """
+        Every replicate has its own random generator spawned from the seed, such that a replicate
+        is reproducible independently of the number of replicates.
+        Output files of the replicate k are written to the directory <wd>/rep<k>.
+        :param design_matrix: pooling design for 1 block
+        :param vcf_in: path to the VCF file to process (GT format)
+        :param dict_lookup: lookup table for GP decoding (see pooler.load_lookup_dict)
+        :param format_to: 'GT' or 'GP'
+        :param n_replicates: number of replicates
+        :param seed: entropy of the replicates random generators
+        :param stu_size: relative size of the study population vs. reference panel
+        :param wd: directory for writing the output files
+        :param batch_size: number of variants which genotypes are read at once
+        """
+        self.path_in = vcf_in
+        self.fmt_to = format_to.upper()
+        self.n_replicates = n_replicates
+        self.seed = seed
+        self.wd = wd
+        self.batch_size = batch_size
+        self.n_variants = 0
+        self.splitter = ShuffleSplitVCF(design_matrix, vcf_in, stu_size=stu_size, wd=wd)
+        self.context = PoolingContext(design_matrix, self.splitter.study_size, dict_lookup, self.fmt_to)
+        self.columns = np.asarray([self._split_samples(k) for k in range(self.n_replicates)])
+
+    def path_replicate(self, k: int, file_name: str) -> str:
+        """Path to a file of the replicate k"""
+        return os.path.join(self.wd, 'rep{}'.format(k), file_name)
+
+    def _split_samples(self, k: int) -> np.ndarray:
+        """
+        Shuffle and assign samples to reference/study for the replicate k
+        :return: indices of the study population in the input file, in block order
+        """
+        rng = np.random.default_rng(np.random.SeedSequence(self.seed).spawn(self.n_replicates)[k])
+        order = rng.permutation(len(self.splitter.samples))
+        os.makedirs(os.path.dirname(self.path_replicate(k, '')), exist_ok=True)
+        self.splitter._assign_samples([self.splitter.samples[i] for i in order],
+                                      self.path_replicate(k, os.path.basename(self.splitter.ref_pan)),
+                                      self.path_replicate(k, os.path.basename(self.splitter.stu_pop)))
+        return order[:self.splitter.study_size]
+
+    def _new_vars(self, batch: GenotypeBatch, true_calls: bool = False) -> Tuple[List[List[str]], List[List[str]]]:
+        """
+        Pools the variants of a batch for all the replicates
+        :param true_calls: also subset the true calls of the study populations
+        :return: string representations of the pooled variants (replicates, variants),
+        and of the true genotypes of the study populations (replicates, variants) if required
+        """
+        assert not batch.missing.any(), 'Pooling missing genotypes not implemented'
+        n_var = len(batch)
+        # (replicates * variants, study samples, 2) in block order for every replicate
+        gt = batch.gt[:, self.columns].swapaxes(0, 1).reshape((-1, self.columns.shape[1], 2))
+        tokens = self.context.pool_tokens(gt).reshape((self.n_replicates, n_var, -1))
+        if true_calls:  # calls as written in the input file, e.g. phased
+            calls = np.asarray([str(rec).rstrip('\n').split('\t', 8)[8] for rec in batch.records], dtype=object)
+            calls = np.asarray([c.split('\t') for c in calls], dtype=object).reshape((n_var, -1))
+        # allele counts in the study populations
+        alleles = gt.reshape((self.n_replicates, n_var, -1))
+        an = (alleles >= 0).sum(axis=-1)
+        n_alts = [alt.count(',') + 1 for alt in batch.sites['alt']]
+        # one count per ALT allele of the sites, observed in the replicate or not
+        ac = (alleles[..., np.newaxis] == np.arange(1, max(n_alts + [1]) + 1)).sum(axis=-2)
+        fixed = [fixed.rsplit('\t', 1) for fixed in batch.sites['fixed']]
+        pooled_lines, true_lines = [], []
+        for k in range(self.n_replicates):
+            cols = ['\t'.join([site, update_counts(info, ac[k, v, :n_alts[v]], an[k, v])])
+                    for v, (site, info) in enumerate(fixed)]
+            pooled_lines.append(['\t'.join([c, self.context.format_key, *t.tolist()]) + '\n'
+                                 for c, t in zip(cols, tokens[k])])
+            if true_calls:
+                true_lines.append(['\t'.join([c, t[0], *t[1:][self.columns[k]].tolist()]) + '\n'
+                                   for c, t in zip(cols, calls)])
+        return pooled_lines, true_lines
+
+    def write(self, file_out: str, file_true: str = None) -> None:
+        """
+        Writes the pooled study population of every replicate into bgzipped and indexed files.
+        :param file_out: name of the pooled files in the replicate directories (.vcf.gz)
+        :param file_true: name of the files for the true genotypes of the study populations (.vcf.gz), not written if None
+        """
+        vcf_in = pysam.VariantFile(self.path_in)
+        samples = [[self.splitter.samples[i] for i in cols] for cols in self.columns]
+        true_header = str(vcf_in.header).rstrip('\n').split('\n')
+        pooled_header(vcf_in.header, self.fmt_to)
+        header = str(vcf_in.header).rstrip('\n').split('\n')
+        outputs = [(file_out, header, 0)] + ([] if file_true is None else [(file_true, true_header, 1)])
+        files = [[pysam.BGZFile(self.path_replicate(k, name), 'wb') for k in range(self.n_replicates)]
+                 for name, _, _ in outputs]
+        for f_outs, (_, lines, _) in zip(files, outputs):
+            for f_out, smp in zip(f_outs, samples):
+                f_out.write(header_samples(lines, smp).encode())
+        print('Pooling data in {} for {} replicates'.format(self.path_in, self.n_replicates).ljust(80, '.'))
+        tm = timeit.default_timer()
+        for batch in GenotypeReader(self.path_in, self.batch_size):
+            new_vars = self._new_vars(batch, true_calls=file_true is not None)
+            for f_outs, (_, _, j) in zip(files, outputs):
+                for f_out, lines in zip(f_outs, new_vars[j]):
+                    f_out.write(''.join(lines).encode())
+            self.n_variants += len(batch)
+            print('{} variants processed in {:06.2f} sec'.format(self.n_variants,
+                                                                 timeit.default_timer() - tm).ljust(80, '.'))
+        for f_outs, (name, _, _) in zip(files, outputs):
+            for k, f_out in enumerate(f_outs):
+                f_out.close()
+                index_compressed(self.path_replicate(k, name))
+        print('Writing data in {}: Done'.format(self.path_replicate('*', file_out)).rjust(80, '.'))
 
 
 class VariantRecordConverter(pysam.VariantRecord):
@@ -273,13 +711,201 @@ class VariantRecordConverter(pysam.VariantRecord):
         new_var['__class__'] = pysam.libcbcf.VariantRecord
 
 
-def pysam_pooler(file_in: str, file_out: str, path_to_lookup: str, wd: str):
+def get_regions(path: str, n_regions: int) -> List[Tuple[str, int, Union[int, None]]]:
+    """
+    Splits the indexed contigs of a VCF file into regions of similar length, in coordinate order.
+    The number of regions per contig is proportional to the contig length in the header.
+    :param path: path to an indexed VCF file
+    :param n_regions: approximate number of regions to split the file into
+    :return: regions as (contig, start, stop), 0-based half-open, stop is None if the contig length is unknown
+    """
+    vcf = pysam.VariantFile(path)
+    assert vcf.index is not None, 'Splitting into regions needs a .csi or .tbi index for {}'.format(path)
+    contigs = [(c, vcf.header.contigs[c].length if c in vcf.header.contigs else None) for c in vcf.index.keys()]
+    total = sum(length for c, length in contigs if length is not None)
+    regions = []
+    for contig, length in contigs:
+        if length is None:
+            regions.append((contig, 0, None))
+            continue
+        n = max(1, int(round(n_regions * length / total)))
+        bounds = np.linspace(0, length, n + 1).astype(int)
+        regions.extend((contig, int(start), int(stop)) for start, stop in zip(bounds[:-1], bounds[1:]))
+    return regions
+
+
+def _pool_region(args: tuple) -> Tuple[str, int, str]:
+    """
+    Worker for VariantFilePooler.write_parallel: pools the variants starting in a region
+    and writes them to a bgzipped part file. The part file is complete as soon as it exists.
+    :return: path to the part file, number of variants pooled, checksum of the part file
+    """
+    path_in, (contig, start, stop), context, path_part, header = args
+    reader = GenotypeReader(path_in, region=(contig, start, stop))
+    n_variants = 0
+
+    def pool_region():
+        nonlocal n_variants
+        for batch in reader:
+            kept = [i for i, var in enumerate(batch.records) if var.start >= start]
+            # overlapping variants not kept are already pooled with the previous region
+            if len(kept) < len(batch):
+                batch = GenotypeBatch(batch.gt[kept], batch.missing[kept], batch.sites[kept],
+                                      [batch.records[i] for i in kept])
+            yield from context.new_vars(batch)
+            n_variants += len(batch)
+
+    path_tmp = '{}.{}.tmp'.format(path_part, os.getpid())
+    if header is None:
+        write_bgzf(path_tmp, pool_region())
+    else:
+        write_bcf(path_tmp, itertools.chain([header], pool_region()))
+    checksum = file_checksum(path_tmp)
+    os.replace(path_tmp, path_part)
+    return path_part, n_variants, checksum
+
+
+MANIFEST = 'manifest.json'
+
+
+def file_checksum(path: str) -> str:
+    """SHA-256 of the content of a file"""
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(2 ** 20), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def load_manifest(checkpoint_dir: str, settings: dict) -> Union[dict, None]:
+    """
+    Reads the manifest of a checkpointed pooling run.
+    :param checkpoint_dir: directory of the run
+    :param settings: settings of the current run
+    :return: manifest, None if there is no manifest or if it was written for other settings
+    """
+    path = os.path.join(checkpoint_dir, MANIFEST)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        manifest = json.load(f)
+    if manifest['settings'] != settings:
+        print('Checkpoints in {} were written for other settings: start again'.format(checkpoint_dir))
+        return None
+    return manifest
+
+
+def save_manifest(checkpoint_dir: str, manifest: dict) -> None:
+    """Writes the manifest of a checkpointed pooling run, atomically"""
+    path = os.path.join(checkpoint_dir, MANIFEST)
+    path_tmp = '{}.{}.tmp'.format(path, os.getpid())
+    with open(path_tmp, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(path_tmp, path)
+
+
+def write_bgzf(path_out: str, lines: Iterable[str], buffer_size: int = 2 ** 20) -> None:
+    """
+    Streams lines of text to a bgzipped file.
+    :param path_out: path to the bgzipped output file
+    :param lines: lines to write, ending with a newline
+    :param buffer_size: size in bytes of the text buffered before being compressed
+    """
+    buffer, size = [], 0
+    with pysam.BGZFile(path_out, 'wb') as f_out:
+        for line in lines:
+            buffer.append(line)
+            size += len(line)
+            if size >= buffer_size:
+                f_out.write(''.join(buffer).encode())
+                buffer, size = [], 0
+        if buffer:
+            f_out.write(''.join(buffer).encode())
+
+
+def write_bcf(path_out: str, lines: Iterable[str]) -> None:
+    """
+    Streams lines of VCF text (header first) to a BCF file.
+    The lines are sent through a pipe to the htslib parser, and the parsed records are written as typed binary records
+    e.g. GL as float arrays, without intermediate text file.
+    The lines are produced (e.g. variants pooled) in the calling thread, only the conversion runs in a background thread.
+    :param path_out: path to the BCF output file
+    :param lines: VCF header and records, ending with a newline
+    """
+    fd_read, fd_write = os.pipe()
+    errors = []
+
+    def convert():
+        vcf_in, vcf_out = None, None
+        try:
+            with os.fdopen(fd_read, 'rb') as f_pipe:
+                vcf_in = pysam.VariantFile(f_pipe)
+                vcf_out = pysam.VariantFile(path_out, 'wb', header=vcf_in.header)
+                for rec in vcf_in:
+                    vcf_out.write(rec)
+        except BaseException as e:  # raised again in the calling thread
+            errors.append(e)
+        finally:  # the read end of the pipe is closed on errors too: the calling thread stops writing
+            for vcf in [vcf_out, vcf_in]:
+                if vcf is not None:
+                    vcf.close()
+
+    converter = threading.Thread(target=convert, daemon=True)
+    converter.start()
+    try:
+        with os.fdopen(fd_write, 'w') as f_pipe:
+            for line in lines:
+                f_pipe.write(line)
+    except BrokenPipeError:  # the conversion failed, its error is raised instead
+        converter.join()
+        if len(errors) == 0:
+            raise
+    finally:
+        converter.join()
+    if len(errors) > 0:
+        raise errors[0]
+
+
+def index_compressed(path: str) -> None:
+    """Builds a .csi index for a bgzipped VCF file or a BCF file, in-process"""
+    if path.endswith('.bcf'):
+        pysam.bcftools.index('-f', path, catch_stdout=False)
+    else:
+        pysam.tabix_index(path, preset='vcf', csi=True, force=True)
+
+
+BGZF_EOF = bytes.fromhex('1f8b08040000000000ff0600424302001b0003000000000000000000')
+
+
+def concatenate_bgzf(parts: List[str], path_out: str) -> None:
+    """
+    Concatenates bgzipped files without recompressing them.
+    BGZF blocks are independent gzip members: the end-of-file marker is removed from all parts but the last.
+    :param parts: paths to the bgzipped files to concatenate, in order
+    :param path_out: path to the bgzipped output file
+    """
+    with open(path_out, 'wb') as f_out:
+        for part in parts:
+            with open(part, 'rb') as f_part:
+                data = f_part.read()
+            if data.endswith(BGZF_EOF):
+                data = data[:-len(BGZF_EOF)]
+            f_out.write(data)
+        f_out.write(BGZF_EOF)
+
+
+def pysam_pooler(file_in: str, file_out: str, path_to_lookup: str, wd: str, processes: int = 1,
+                 out_format: str = 'vcf', checkpoint_dir: str = None, split_contigs: bool = False):
     """
     Process a VCF file with NORB pooling simulation.
     :param file_in: name of the file to be processed (.vcf.gz or .vcf only)
-    :param file_out: name of the file to output (NO .gz)
+    :param file_out: name of the file to output (NO .gz, .vcf replaced with .bcf for BCF output)
     :param path_to_lookup: lookup table to use for GP decoding
     :param wd: path to the data directory
+    :param processes: number of processes pooling regions of the file in parallel (the input file must be indexed)
+    :param out_format: 'vcf' or 'bcf'
+    :param checkpoint_dir: directory for committing pooled regions, for resuming an interrupted run
+    :param split_contigs: write one pooled file per contig
     """
     design = Design()
     dm = design.matrix
@@ -291,10 +917,65 @@ def pysam_pooler(file_in: str, file_out: str, path_to_lookup: str, wd: str):
                               os.path.join(wd, file_in),
                               os.path.join(wd, file_out),
                               dict_gl,
-                              'GP')
+                              'GP',
+                              out_format=out_format)
 
     tstart = timeit.default_timer()
-    poolf.write()
+    if processes > 1 or checkpoint_dir is not None or split_contigs:
+        poolf.write_parallel(processes, checkpoint_dir=checkpoint_dir, split_contigs=split_contigs)
+    else:
+        poolf.write()
     tstop = timeit.default_timer()
     print('Time for pooling {} variants = {} sec'.format(poolf.n_variants, tstop - tstart))
 
+
+def pysam_replicates(file_in: str, file_out: str, path_to_lookup: str, wd: str, n_replicates: int,
+                     seed: int = 123, file_true: str = None):
+    """
+    Process a VCF file with NORB pooling simulation for several random splits of the samples.
+    :param file_in: name of the file to be processed (.vcf.gz or .vcf only)
+    :param file_out: name of the pooled files to output in every replicate directory (.vcf.gz)
+    :param path_to_lookup: lookup table to use for GP decoding
+    :param wd: path to the data directory
+    :param n_replicates: number of replicates
+    :param seed: entropy of the replicates random generators
+    :param file_true: name of the files for the true genotypes of the study populations (.vcf.gz)
+    """
+    design = Design()
+    dict_gl = load_lookup_dict(path_to_lookup)
+    poolf = ReplicatePooler(design.matrix, os.path.join(wd, file_in), dict_gl, 'GP', n_replicates,
+                            seed=seed, wd=wd)
+    tstart = timeit.default_timer()
+    poolf.write(file_out, file_true=file_true)
+    tstop = timeit.default_timer()
+    print('Time for pooling {} variants in {} replicates = {} sec'.format(poolf.n_variants, n_replicates,
+                                                                       tstop - tstart))
+
+
+if __name__ == '__main__':
+    # Serial pooling to BCF exits cleanly (run in a subprocess under a timeout) and writes the records of the VCF output
+    import shutil
+    import subprocess
+    import tempfile
+
+    path_examples = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'examples')
+    vcf = os.path.join(path_examples, 'TEST.chr20.snps.gt.vcf.gz')
+    tmpdir = tempfile.mkdtemp()
+    # a new process per output: pooling to BCF must not come after pooling in the main thread of the same process
+    script = '\n'.join(['from VCFPooling.poolSNPs.pooler import *',
+                        'from VCFPooling.poolSNPs import poolvcf',
+                        'lookup = load_lookup_dict({!r})'.format(os.path.join(path_examples, 'adaptive_gls.csv')),
+                        'poolvcf.VariantFilePooler(Design().matrix, {!r}, {!r}, lookup, {!r}, out_format={!r}).write()'])
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([rootdir] + sys.path))
+    for fmt in ['GP', 'GT']:
+        path_out = os.path.join(tmpdir, 'pooled.{}.vcf'.format(fmt))
+        for out_format in ['bcf', 'vcf']:
+            proc = subprocess.run([sys.executable, '-c', script.format(vcf, path_out, fmt, out_format)], env=env,
+                                  timeout=120, stdout=subprocess.DEVNULL)
+            assert proc.returncode == 0, 'Pooling to {} {} exited with status {}'.format(fmt, out_format,
+                                                                                       proc.returncode)
+        records_vcf = [str(rec) for rec in pysam.VariantFile(path_out + '.gz')]
+        records_bcf = [str(rec) for rec in pysam.VariantFile(path_out[:-4] + '.bcf')]
+        assert records_vcf == records_bcf, 'BCF and VCF records differ'
+        print('{}: {} variants pooled to BCF, equal to the VCF output'.format(fmt, len(records_bcf)))
+    shutil.rmtree(tmpdir)
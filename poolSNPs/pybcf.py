@@ -97,8 +97,8 @@ def stratified_aaf_sampling(f_gz: str, wd: str, binning: bool = False) -> None:
     """
     os.chdir(wd)
     print(wd)
-    extract_header(os.path.join(prm.DATA_PATH, 'gt', 'ALL.chr20.snps.gt.vcf.gz'),
-                   'headers.ALL.chr20.snps.gt.chunk{}.strat.vcf'.format(prm.CHK_SZ),
+    extract_header(os.path.join(prm.DATA_PATH, 'gt', prm.SRCFILE),
+                   'headers.ALL.{}.snps.gt.chunk{}.strat.vcf'.format(prm.chrom_name, prm.CHK_SZ),
                    wd)
     bins = np.arange(0.0, 1.0, 0.1)
     for b in bins:
@@ -126,22 +126,22 @@ def stratified_aaf_sampling(f_gz: str, wd: str, binning: bool = False) -> None:
         subprocess.run(tmp, shell=True, cwd=wd)
         # subprocess.run(cmd2, shell=True, cwd=wd)
 
-    subprocess.run(' '.join(['cat headers.ALL.chr20.snps.gt.chunk{}.strat.vcf '.format(prm.CHK_SZ),
+    subprocess.run(' '.join(['cat headers.ALL.{}.snps.gt.chunk{}.strat.vcf '.format(prm.chrom_name, prm.CHK_SZ),
                              ' '.join(['chunk{}.vcf'.format(i) for i in bins]),
-                             '> TMP.chr20.snps.gt.strat.vcf']),
+                             '> TMP.{}.snps.gt.strat.vcf'.format(prm.chrom_name)]),
                    shell=True,
                    cwd=wd)
 
-    delete_file('ALL.chr20.snps.gt.chunk{}.vcf.gz.csi'.format(prm.CHK_SZ))
+    delete_file('ALL.{}.snps.gt.chunk{}.vcf.gz.csi'.format(prm.chrom_name, prm.CHK_SZ))
 
-    bgzip('TMP.chr20.snps.gt.strat.vcf'.format(prm.CHK_SZ),
-          'ALL.chr20.snps.gt.chunk{}.vcf.gz'.format(prm.CHK_SZ),
+    bgzip('TMP.{}.snps.gt.strat.vcf'.format(prm.chrom_name, prm.CHK_SZ),
+          'ALL.{}.snps.gt.chunk{}.vcf.gz'.format(prm.chrom_name, prm.CHK_SZ),
           wd)
-    sort('ALL.chr20.snps.gt.chunk{}.vcf.gz'.format(prm.CHK_SZ),
+    sort('ALL.{}.snps.gt.chunk{}.vcf.gz'.format(prm.chrom_name, prm.CHK_SZ),
          wd)
-    index('ALL.chr20.snps.gt.chunk{}.vcf.gz'.format(prm.CHK_SZ),
+    index('ALL.{}.snps.gt.chunk{}.vcf.gz'.format(prm.chrom_name, prm.CHK_SZ),
           wd)
-    delete_file('headers.ALL.chr20.snps.gt.chunk{}.strat.vcf'.format(prm.CHK_SZ))
+    delete_file('headers.ALL.{}.snps.gt.chunk{}.strat.vcf'.format(prm.chrom_name, prm.CHK_SZ))
     print('Stratification ended\n\n'.ljust(80, '.'))
     # delete_file('TMP.chr20.snps.gt.strat.vcf')
     # for i in bins: